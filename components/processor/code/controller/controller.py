@@ -187,17 +187,17 @@ class Communicator:
             logging.info(self.cam.disk_space)
 
             try:
-                detector_lag = str(
-                    round(
-                        len(self.detector.image_cache)
-                        * self.detector.keep_sending_after_phash_diff,
-                        1,
-                    )
-                )
+                detector_lag = str(round(self.detector.image_cache.queued_seconds(), 1))
             except Exception as e:
                 detector_lag = "NA"
                 logging.warning(e)
 
+            try:
+                detector_statistics = self.detector.statistics()
+            except Exception as e:
+                detector_statistics = {}
+                logging.warning(e)
+
             self._check_diskspace()
 
             client_state = {
@@ -212,6 +212,7 @@ class Communicator:
                 "load": str(psutil.getloadavg()),
                 "memory_used_%": psutil.virtual_memory().percent,
                 "detector_lag": detector_lag,
+                "detector_statistics": detector_statistics,
             }
             values = {
                 "token": self.token,
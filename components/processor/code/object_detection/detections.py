@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+# detected classes which are tracked and written to ROI metadata
+VALID_VEHICLE_CLASSES = ["car", "motorcycle", "bus", "truck"]
+
+# record of an object detection, track_id is -1 until assigned by the tracker
+DETECTION_DTYPE = np.dtype(
+    [
+        ("bbox", np.float32, (4,)),
+        ("confidence", np.float32),
+        ("class_id", np.int32),
+        ("track_id", np.int32),
+    ]
+)
+
+
+def detection_records(detections):
+    """Convert detections returned by an object detection backend to records
+
+    Args:
+        detections (numpy.ndarray): Rows containing bounding box, confidence
+            and class index
+
+    Returns:
+        numpy.ndarray: Detections as DETECTION_DTYPE records
+    """
+    records = np.empty(detections.shape[0], dtype=DETECTION_DTYPE)
+    records["bbox"] = detections[:, :4]
+    records["confidence"] = detections[:, 4]
+    records["class_id"] = detections[:, 5]
+    records["track_id"] = -1
+    return records
+
+
+def detections_to_dicts(detections, names):
+    """Convert detection records to detection dictionaries
+
+    Args:
+        detections (numpy.ndarray): DETECTION_DTYPE records
+        names (List): Labels of class indices
+
+    Returns:
+        List: Object detection results as a list of dictionaries containing
+              bounding boxes, confidence and label
+    """
+    return [
+        {"bbox": bbox, "confidence": confidence, "label": names[class_id]}
+        for bbox, confidence, class_id in zip(
+            detections["bbox"].tolist(),
+            detections["confidence"].tolist(),
+            detections["class_id"].tolist(),
+        )
+    ]
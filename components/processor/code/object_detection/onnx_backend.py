@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import os
+import numpy as np
+
+from object_detection.preprocess import InputBuffers, apply_letterbox
+
+MAX_DETECTIONS = 300
+
+
+def export_onnx(weights, onnx_path, im_size):
+    """Export PyTorch weights to an ONNX model with a fixed square input and a
+    dynamic batch size. Class names are stored in the model metadata. Requires
+    torch, the yolov5 repository and onnx.
+
+    Args:
+        weights (str): Path of the PyTorch weights
+        onnx_path (str): Path of the exported model
+        im_size (int): Input size of the model
+    """
+    import onnx
+    import torch
+    import torch.nn as nn
+
+    import models.common
+    from models.experimental import attempt_load
+    from utils.activations import Hardswish
+
+    logging.info(f"Exporting {weights} to {onnx_path}")
+    model = attempt_load(weights, map_location=torch.device("cpu"))
+    for module in model.modules():
+        module._non_persistent_buffers_set = set()
+        # nn.Hardswish can not be exported, use the export friendly version
+        if isinstance(module, models.common.Conv) and isinstance(
+            module.act, nn.Hardswish
+        ):
+            module.act = Hardswish()
+    model.eval()
+
+    im_pt = torch.zeros((1, 3, im_size, im_size))
+    _ = model(im_pt)  # build grids of the Detect layer for the input size
+    torch.onnx.export(
+        model,
+        im_pt,
+        onnx_path,
+        opset_version=12,
+        input_names=["images"],
+        output_names=["output"],
+        dynamic_axes={"images": {0: "batch"}, "output": {0: "batch"}},
+    )
+
+    names = model.module.names if hasattr(model, "module") else model.names
+    onnx_model = onnx.load(onnx_path)
+    onnx.checker.check_model(onnx_model)
+    meta = onnx_model.metadata_props.add()
+    meta.key = "names"
+    meta.value = json.dumps(list(names))
+    onnx.save(onnx_model, onnx_path)
+
+
+def letterbox_geometry(im0_shape, im_size):
+    """Calculate geometry of resizing an image keeping the aspect ratio and
+    padding it to a square, as the letterbox of yolov5 without minimum
+    rectangle padding
+
+    Args:
+        im0_shape (Tuple): Shape of the input image
+        im_size (int): Width and height of the letterboxed image
+
+    Returns:
+        Tuple(Tuple, Tuple, Tuple): Letterboxed shape, padding (top, left) and
+            resized shape, each as (height, width)
+    """
+    shape = im0_shape[:2]
+    r = min(im_size / shape[0], im_size / shape[1])
+    width, height = int(round(shape[1] * r)), int(round(shape[0] * r))
+    top = int(round((im_size - height) / 2 - 0.1))
+    left = int(round((im_size - width) / 2 - 0.1))
+    return (im_size, im_size), (top, left), (height, width)
+
+
+def letterbox(im0, im_size, color=(114, 114, 114)):
+    """Resize image keeping the aspect ratio and pad it to a square, as the
+    letterbox of yolov5 without minimum rectangle padding
+
+    Args:
+        im0 (numpy.ndarray): Input image
+        im_size (int): Width and height of the letterboxed image
+        color (Tuple, optional): Padding color. Defaults to (114, 114, 114).
+
+    Returns:
+        numpy.ndarray: Letterboxed image
+    """
+    return apply_letterbox(im0, letterbox_geometry(im0.shape, im_size), color)
+
+
+def scale_coords(im_shape, coords, im0_shape):
+    """Rescale xyxy boxes from letterboxed image to original image coordinates,
+    in place
+
+    Args:
+        im_shape (Tuple): Height and width of the letterboxed image
+        coords (numpy.ndarray): Boxes with xyxy coordinates in the first columns
+        im0_shape (Tuple): Shape of the original image
+
+    Returns:
+        numpy.ndarray: Rescaled boxes clipped to the original image
+    """
+    gain = min(im_shape[0] / im0_shape[0], im_shape[1] / im0_shape[1])
+    pad_x = (im_shape[1] - im0_shape[1] * gain) / 2
+    pad_y = (im_shape[0] - im0_shape[0] * gain) / 2
+    coords[:, [0, 2]] -= pad_x
+    coords[:, [1, 3]] -= pad_y
+    coords[:, :4] /= gain
+    coords[:, [0, 2]] = coords[:, [0, 2]].clip(0, im0_shape[1])
+    coords[:, [1, 3]] = coords[:, [1, 3]].clip(0, im0_shape[0])
+    return coords
+
+
+def scale_batch_coords(im_shape, pred, im0_shapes):
+    """Rescale and round detections of a batch from letterboxed image to
+    original image coordinates, in place. Detections of all images are
+    rescaled at once if the original shapes match.
+
+    Args:
+        im_shape (Tuple): Height and width of the letterboxed images
+        pred (List): Array of detections for each image, rows containing xyxy
+            box, confidence and class index
+        im0_shapes (List): Shapes of the original images
+
+    Returns:
+        List: Rescaled detections of each image
+    """
+    if all(shape == im0_shapes[0] for shape in im0_shapes):
+        counts = [len(detections) for detections in pred]
+        pred_all = np.concatenate(pred)
+        scale_coords(im_shape, pred_all, im0_shapes[0])
+        pred_all[:, :4] = pred_all[:, :4].round()
+        return np.split(pred_all, np.cumsum(counts)[:-1])
+
+    for detections, im0_shape in zip(pred, im0_shapes):
+        scale_coords(im_shape, detections, im0_shape)
+        detections[:, :4] = detections[:, :4].round()
+    return pred
+
+
+def nms(boxes, scores, iou_thres):
+    """Greedy non-maximum suppression, as torchvision.ops.nms
+
+    Args:
+        boxes (numpy.ndarray): Boxes with xyxy coordinates
+        scores (numpy.ndarray): Scores of the boxes
+        iou_thres (float): Boxes overlapping a better box more than this are
+            discarded
+
+    Returns:
+        numpy.ndarray: Indices of the kept boxes in decreasing order of score
+    """
+    x1, y1, x2, y2 = boxes.T
+    areas = (x2 - x1) * (y2 - y1)
+    order = np.argsort(-scores, kind="stable")
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(i)
+        others = order[1:]
+        w = (np.minimum(x2[i], x2[others]) - np.maximum(x1[i], x1[others])).clip(0)
+        h = (np.minimum(y2[i], y2[others]) - np.maximum(y1[i], y1[others])).clip(0)
+        inter = w * h
+        iou = inter / (areas[i] + areas[others] - inter)
+        order = others[iou <= iou_thres]
+    return np.array(keep, dtype=np.int64)
+
+
+def non_max_suppression(prediction, conf_thres, iou_thres, classes=None):
+    """Class agnostic non-maximum suppression of raw model output, as
+    non_max_suppression of yolov5 with multiple labels per box
+
+    Args:
+        prediction (numpy.ndarray): Model output of shape (batch, boxes, 5 + classes)
+            with xywh box, objectness and class scores
+        conf_thres (float): Confidence threshold
+        iou_thres (float): IoU threshold
+        classes (List, optional): Indices of kept classes. Defaults to None,
+            keeping all classes.
+
+    Returns:
+        List: Array of detections for each image, rows containing xyxy box,
+              confidence and class index
+    """
+    output = []
+    for x in prediction:
+        x = x[x[:, 4] > conf_thres]
+        scores = x[:, 5:] * x[:, 4:5]
+        i, j = np.nonzero(scores > conf_thres)
+        if classes is not None:
+            kept = np.isin(j, classes)
+            i, j = i[kept], j[kept]
+
+        box = np.empty((len(i), 4), dtype=np.float32)
+        box[:, :2] = x[i, :2] - x[i, 2:4] / 2
+        box[:, 2:] = x[i, :2] + x[i, 2:4] / 2
+        detections = np.concatenate(
+            (box, scores[i, j, None], j[:, None].astype(np.float32)), axis=1
+        )
+
+        keep = nms(detections[:, :4], detections[:, 4], iou_thres)
+        output.append(detections[keep[:MAX_DETECTIONS]])
+    return output
+
+
+def model_path(path, im_size, default_size):
+    """Path of the model for an input size. Models of other than the default
+    input size have the size appended to the file name.
+
+    Args:
+        path (str): Path of the model with the default input size
+        im_size (int): Input size
+        default_size (int): Default input size
+
+    Returns:
+        str: Path of the model
+    """
+    if im_size == default_size:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}_{im_size}{ext}"
+
+
+class OnnxBackend:
+    def __init__(self, weights, onnx_path, im_size, int8_path="", calibration_path=""):
+        """YOLOv5 model run with the CPU execution provider of ONNX Runtime.
+        The model is exported from the PyTorch weights if it does not exist,
+        after which torch is not needed. With an INT8 path, the quantized
+        model is used, and created from the exported model if it does not exist.
+        Each input size has its own model, loaded on first use.
+
+        Args:
+            weights (str): Path of the PyTorch weights
+            onnx_path (str): Path of the ONNX model
+            im_size (int): Default input size of the model
+            int8_path (str, optional): Path of the quantized model. Defaults to "".
+            calibration_path (str, optional): Video file or folder of images for
+                static quantization. Defaults to "", using dynamic quantization.
+        """
+        self.weights = weights
+        self.onnx_path = onnx_path
+        self.int8_path = int8_path
+        self.calibration_path = calibration_path
+        self.im_size = im_size
+        self.sessions = {}
+        # module level function, passed from detection workers to the pool
+        self.letterbox_geometry = letterbox_geometry
+        self.buffers = InputBuffers(letterbox_geometry)
+
+        session = self._session(self.im_size)
+        self.names = json.loads(session.get_modelmeta().custom_metadata_map["names"])
+
+        im = np.zeros((1, 3, self.im_size, self.im_size), dtype=np.float32)
+        _ = session.run(None, {session.get_inputs()[0].name: im})
+
+    def _session(self, im_size):
+        """Retrieve inference session of an input size, exporting and
+        quantizing the model if needed
+
+        Args:
+            im_size (int): Input size of the model
+
+        Returns:
+            onnxruntime.InferenceSession: Inference session
+        """
+        if im_size in self.sessions:
+            return self.sessions[im_size]
+
+        import onnxruntime
+
+        onnx_path = model_path(self.onnx_path, im_size, self.im_size)
+        int8_path = (
+            model_path(self.int8_path, im_size, self.im_size) if self.int8_path else ""
+        )
+        path = int8_path or onnx_path
+        if not os.path.exists(path):
+            if not os.path.exists(onnx_path):
+                export_onnx(self.weights, onnx_path, im_size)
+            if int8_path:
+                from object_detection.quantization import quantize_onnx
+
+                quantize_onnx(
+                    onnx_path,
+                    int8_path,
+                    lambda im0: letterbox(im0, im_size),
+                    self.calibration_path,
+                )
+
+        logging.info("Loading model: {}".format(path))
+        self.sessions[im_size] = onnxruntime.InferenceSession(
+            path, providers=["CPUExecutionProvider"]
+        )
+        return self.sessions[im_size]
+
+    def letterbox(self, im0, im_size):
+        """Resize and pad image to the square input of the model
+
+        Args:
+            im0 (numpy.ndarray): Input image
+            im_size (int): Input size of the model
+
+        Returns:
+            numpy.ndarray: Letterboxed image
+        """
+        return letterbox(im0, im_size)
+
+    def detect(self, im, im0_shapes, conf_thres, iou_thres, classes=None):
+        """Perform object detection for a batch of letterboxed images
+
+        Args:
+            im (numpy.ndarray): Model input from self.buffers
+            im0_shapes (List): Shapes of the original images
+            conf_thres (float): Confidence threshold
+            iou_thres (float): IoU threshold of non-maximum suppression
+            classes (List, optional): Indices of detected classes. Defaults to None,
+                detecting all classes.
+
+        Returns:
+            List: Array of detections for each image, rows containing
+                  rounded bounding box in original image coordinates,
+                  confidence and class index
+        """
+        session = self._session(im.shape[2])
+        pred = session.run(None, {session.get_inputs()[0].name: im})[0]
+        pred = non_max_suppression(pred, conf_thres, iou_thres, classes)
+        return scale_batch_coords(im.shape[2:], pred, im0_shapes)
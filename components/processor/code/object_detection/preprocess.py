@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+import cv2
+import numpy as np
+
+
+PAD_VALUE = 114
+
+
+def apply_letterbox(im0, geometry, color=(PAD_VALUE, PAD_VALUE, PAD_VALUE)):
+    """Resize and pad image according to a letterbox geometry
+
+    Args:
+        im0 (numpy.ndarray): Input image
+        geometry (Tuple): Letterboxed shape, padding (top, left) and resized
+            shape, as returned by the letterbox geometry of a backend
+        color (Tuple, optional): Padding color. Defaults to (114, 114, 114).
+
+    Returns:
+        numpy.ndarray: Letterboxed image
+    """
+    shape, (top, left), (height, width) = geometry
+    im = im0
+    if im0.shape[:2] != (height, width):
+        im = cv2.resize(im0, (width, height), interpolation=cv2.INTER_LINEAR)
+    bottom = shape[0] - height - top
+    right = shape[1] - width - left
+    return cv2.copyMakeBorder(
+        im, top, bottom, left, right, cv2.BORDER_CONSTANT, value=color
+    )
+
+
+class InputBuffers:
+    def __init__(self, letterbox_geometry, allocate=None, dtype=np.float32):
+        """Preallocated input of the object detection model. Letterbox geometry
+        is computed once for each frame shape, frames are resized into reused
+        buffers, and color swap, layout change and normalization are done in a
+        single pass writing directly into the model input.
+
+        Args:
+            letterbox_geometry (Callable): Function returning letterboxed shape,
+                padding (top, left) and resized shape for a frame shape and an
+                input size
+            allocate (Callable, optional): Function allocating a model input array
+                of given shape, e.g. in pinned memory. Defaults to numpy.empty.
+            dtype (numpy.dtype, optional): Data type of the model input.
+                Defaults to numpy.float32.
+        """
+        self.letterbox_geometry = letterbox_geometry
+        self.allocate = allocate or (lambda shape: np.empty(shape, dtype=dtype))
+        self.dtype = dtype
+        self.pad_value = np.divide(PAD_VALUE, 255, dtype=dtype)
+        self.geometries = {}
+        self.inputs = {}
+        self.resized = {}
+
+    def geometry(self, im0_shape, im_size):
+        """Retrieve cached letterbox geometry
+
+        Args:
+            im0_shape (Tuple): Shape of the frame
+            im_size (int): Input size of the model
+
+        Returns:
+            Tuple(Tuple, Tuple, Tuple): Letterboxed shape, padding (top, left) and
+                resized shape, each as (height, width)
+        """
+        key = (tuple(im0_shape[:2]), im_size)
+        if key not in self.geometries:
+            self.geometries[key] = self.letterbox_geometry(im0_shape, im_size)
+        return self.geometries[key]
+
+    def _input(self, batch, shape):
+        """Retrieve the model input array of a batch, growing it if needed
+
+        Args:
+            batch (int): Number of images
+            shape (Tuple): Height and width of the letterboxed images
+
+        Returns:
+            numpy.ndarray: Array of shape (batch, 3, height, width)
+        """
+        if shape not in self.inputs or self.inputs[shape].shape[0] < batch:
+            self.inputs[shape] = self.allocate((batch, 3) + tuple(shape))
+        return self.inputs[shape][:batch]
+
+    def _convert(self, im, out):
+        """Convert BGR HWC uint8 image to RGB CHW image scaled to 0.0 - 1.0
+
+        Args:
+            im (numpy.ndarray): Source image
+            out (numpy.ndarray): Destination in the model input
+        """
+        np.divide(
+            im[:, :, ::-1].transpose(2, 0, 1),
+            255,
+            out=out,
+            dtype=self.dtype,
+            casting="unsafe",
+        )
+
+    def from_frames(self, im0s, im_size):
+        """Letterbox frames of the same shape into the model input
+
+        Args:
+            im0s (List): Frames
+            im_size (int): Input size of the model
+
+        Returns:
+            numpy.ndarray: Model input of shape (batch, 3, height, width)
+        """
+        shape, (top, left), (height, width) = self.geometry(im0s[0].shape, im_size)
+        out = self._input(len(im0s), shape)
+        if (height, width) not in self.resized:
+            self.resized[(height, width)] = np.empty((height, width, 3), np.uint8)
+        resized = self.resized[(height, width)]
+
+        for i, im0 in enumerate(im0s):
+            im = im0
+            if im0.shape[:2] != (height, width):
+                im = cv2.resize(
+                    im0, (width, height), dst=resized, interpolation=cv2.INTER_LINEAR
+                )
+            out[i, :, :top] = self.pad_value
+            out[i, :, top + height :] = self.pad_value
+            out[i, :, top : top + height, :left] = self.pad_value
+            out[i, :, top : top + height, left + width :] = self.pad_value
+            self._convert(im, out[i, :, top : top + height, left : left + width])
+        return out
+
+    def from_letterboxed(self, ims):
+        """Copy letterboxed images of the same shape into the model input
+
+        Args:
+            ims (List): Letterboxed images
+
+        Returns:
+            numpy.ndarray: Model input of shape (batch, 3, height, width)
+        """
+        out = self._input(len(ims), ims[0].shape[:2])
+        for i, im in enumerate(ims):
+            self._convert(im, out[i])
+        return out
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+import cv2
+import glob
+import logging
+import os
+import numpy as np
+
+
+def read_frames(path, count):
+    """Read frames evenly spaced over a video, or images of a folder
+
+    Args:
+        path (str): Video file or folder of images
+        count (int): Maximum number of frames
+
+    Returns:
+        List: Frames as BGR images
+    """
+    if os.path.isdir(path):
+        filenames = sorted(
+            f
+            for f in glob.glob(os.path.join(path, "*"))
+            if os.path.splitext(f)[1].lower() in (".jpg", ".jpeg", ".png")
+        )
+        step = max(len(filenames) / count, 1)
+        ims = [
+            cv2.imread(filenames[int(i * step)])
+            for i in range(count)
+            if int(i * step) < len(filenames)
+        ]
+        return [im for im in ims if im is not None]
+
+    ims = []
+    cap = cv2.VideoCapture(path)
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    for frame_no in sorted(set(np.linspace(0, frame_count - 1, count).astype(int))):
+        cap.set(cv2.CAP_PROP_POS_FRAMES, frame_no)
+        ret, im = cap.read()
+        if ret:
+            ims.append(im)
+    cap.release()
+    return ims
+
+
+class CalibrationReader:
+    def __init__(self, ims, input_name, letterbox):
+        """Calibration data of static quantization, compatible with
+        onnxruntime.quantization.CalibrationDataReader
+
+        Args:
+            ims (List): Calibration frames
+            input_name (str): Name of the model input
+            letterbox (Callable): Function creating the model input image
+        """
+        self.ims = iter(ims)
+        self.input_name = input_name
+        self.letterbox = letterbox
+
+    def get_next(self):
+        """Retrieve input of the next calibration frame
+
+        Returns:
+            dict or None: Model input by name, None when all frames are used
+        """
+        im = next(self.ims, None)
+        if im is None:
+            return None
+
+        im = self.letterbox(im)[None, :, :, ::-1].transpose(0, 3, 1, 2)
+        return {self.input_name: np.ascontiguousarray(im, dtype=np.float32) / 255.0}
+
+
+def quantize_onnx(onnx_path, int8_path, letterbox, calibration_path="", frames=100):
+    """Quantize convolutions of an ONNX model to INT8. Activations are
+    calibrated statically on given footage, otherwise they are quantized
+    dynamically at run time. Requires onnx.
+
+    Args:
+        onnx_path (str): Path of the FP32 model
+        int8_path (str): Path of the quantized model
+        letterbox (Callable): Function creating the model input image
+        calibration_path (str, optional): Video file or folder of images used
+            for calibration. Defaults to "", using dynamic quantization.
+        frames (int, optional): Number of calibration frames. Defaults to 100.
+    """
+    import onnx
+    from onnxruntime.quantization import QuantType, quantize_dynamic, quantize_static
+
+    if calibration_path:
+        ims = read_frames(calibration_path, frames)
+        logging.info(
+            f"Quantizing {onnx_path} to {int8_path}, calibrated with {len(ims)} "
+            f"frames of {calibration_path}"
+        )
+        input_name = onnx.load(onnx_path).graph.input[0].name
+        quantize_static(
+            onnx_path,
+            int8_path,
+            CalibrationReader(ims, input_name, letterbox),
+            op_types_to_quantize=["Conv"],
+        )
+    else:
+        logging.info(f"Quantizing {onnx_path} to {int8_path} dynamically")
+        quantize_dynamic(
+            onnx_path,
+            int8_path,
+            op_types_to_quantize=["Conv"],
+            weight_type=QuantType.QUInt8,
+        )
+
+    # keep the class names stored in the metadata
+    model = onnx.load(onnx_path)
+    int8_model = onnx.load(int8_path)
+    del int8_model.metadata_props[:]
+    int8_model.metadata_props.extend(model.metadata_props)
+    onnx.save(int8_model, int8_path)
+
+
+def average_precision(detections, references, label, min_iou=0.5):
+    """Calculate average precision of detections of one class, using another
+    set of detections as the ground truth
+
+    Args:
+        detections (List): Detections of each frame as lists of dictionaries
+            containing bounding box, confidence and label
+        references (List): Ground truth detections of each frame
+        label (str): Evaluated class
+        min_iou (float, optional): IoU needed for a match. Defaults to 0.5.
+
+    Returns:
+        Tuple(float, float): Average precision and recall, None if there are
+            no ground truth detections of the class
+    """
+    candidates = []
+    ground_truth = []
+    for frame_detections, frame_references in zip(detections, references):
+        boxes = np.array(
+            [d["bbox"] for d in frame_references if d["label"] == label]
+        ).reshape(-1, 4)
+        ground_truth.append([boxes, np.zeros(len(boxes), dtype=bool)])
+        candidates += [
+            (d["confidence"], len(ground_truth) - 1, d["bbox"])
+            for d in frame_detections
+            if d["label"] == label
+        ]
+
+    positives = sum(len(boxes) for boxes, _ in ground_truth)
+    if not positives:
+        return None, None
+
+    true_positives = []
+    for _, frame, bbox in sorted(candidates, key=lambda c: -c[0]):
+        boxes, used = ground_truth[frame]
+        if not len(boxes):
+            true_positives.append(False)
+            continue
+        w = np.minimum(boxes[:, 2], bbox[2]) - np.maximum(boxes[:, 0], bbox[0])
+        h = np.minimum(boxes[:, 3], bbox[3]) - np.maximum(boxes[:, 1], bbox[1])
+        inter = w.clip(0) * h.clip(0)
+        union = (
+            (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+            + (bbox[2] - bbox[0]) * (bbox[3] - bbox[1])
+            - inter
+        )
+        iou = inter / np.maximum(union, 1e-9)
+        best = int(np.argmax(iou))
+        matched = iou[best] >= min_iou and not used[best]
+        if matched:
+            used[best] = True
+        true_positives.append(matched)
+
+    true_positives = np.array(true_positives, dtype=bool)
+    tp = np.cumsum(true_positives)
+    recall = tp / positives
+    precision = tp / np.arange(1, len(tp) + 1)
+
+    # all point interpolated area under the precision-recall curve
+    recall = np.concatenate(([0.0], recall, [1.0]))
+    precision = np.concatenate(([0.0], precision, [0.0]))
+    precision = np.maximum.accumulate(precision[::-1])[::-1]
+    steps = np.nonzero(recall[1:] != recall[:-1])[0]
+    ap = np.sum((recall[steps + 1] - recall[steps]) * precision[steps + 1])
+    return float(ap), float(recall[-2])
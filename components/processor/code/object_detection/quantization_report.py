@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import os
+import numpy as np
+
+from time import time
+
+from object_detection.detections import VALID_VEHICLE_CLASSES
+from object_detection.quantization import average_precision, read_frames
+from object_detection.yolo import Yolov5
+
+logging.basicConfig(level=logging.INFO)
+
+
+def _run(backend, ims, batch_size):
+    """Detect objects in frames and measure throughput
+
+    Args:
+        backend (str): Inference backend of the object detector
+        ims (List): Frames
+        batch_size (int): Number of frames in a forward pass
+
+    Returns:
+        Tuple(List, float): Detections of each frame and frames per second
+    """
+    yolo = Yolov5(backend)
+    detections = []
+    start = time()
+    for i in range(0, len(ims), batch_size):
+        detections += yolo.detect_batch(ims[i : i + batch_size])
+    return detections, len(ims) / (time() - start)
+
+
+def quantization_report(ims, reference_backend, backend, batch_size):
+    """Compare vehicle detections and throughput of an object detection backend
+    to a reference backend. Detections of the reference are used as the ground
+    truth, so the mAP measures drift from the reference instead of accuracy.
+
+    Args:
+        ims (List): Frames
+        reference_backend (str): Reference backend, e.g. "onnx" for FP32
+        backend (str): Evaluated backend, e.g. "onnx-int8"
+        batch_size (int): Number of frames in a forward pass
+
+    Returns:
+        dict: AP and recall of each vehicle class, mAP, mAP drift, and frames
+              per second of both backends
+    """
+    references, reference_fps = _run(reference_backend, ims, batch_size)
+    detections, fps = _run(backend, ims, batch_size)
+
+    classes = {}
+    for label in VALID_VEHICLE_CLASSES:
+        ap, recall = average_precision(detections, references, label)
+        if ap is not None:
+            classes[label] = {
+                "ap": round(ap, 4),
+                "recall": round(recall, 4),
+                "reference_detections": sum(
+                    d["label"] == label for frame in references for d in frame
+                ),
+            }
+
+    mean_ap = np.mean([c["ap"] for c in classes.values()]) if classes else None
+    return {
+        "frames": len(ims),
+        "reference_backend": reference_backend,
+        "backend": backend,
+        "classes": classes,
+        "map": round(float(mean_ap), 4) if mean_ap is not None else None,
+        "map_drift": round(1 - float(mean_ap), 4) if mean_ap is not None else None,
+        "reference_fps": round(reference_fps, 2),
+        "fps": round(fps, 2),
+        "speedup": round(fps / reference_fps, 2),
+    }
+
+
+def main():
+    """Entry point for measuring the effect of a quantized object detector
+    on vehicle detections and throughput, compared to the FP32 model.
+
+    Args read from environment variables:
+        EVAL_PATH: Video file or folder of images used for evaluation
+        EVAL_FRAMES: Number of frames evenly spaced over the footage
+        EVAL_REFERENCE_BACKEND: Reference backend, defaults to onnx (FP32)
+        EVAL_BACKEND: Evaluated backend, defaults to onnx-int8
+        YOLO_BATCH_SIZE: Number of frames in a forward pass, defaults to 8
+    """
+    path = os.getenv("EVAL_PATH", "videos/demo.mp4")
+    frames = int(os.getenv("EVAL_FRAMES", 200))
+    reference_backend = os.getenv("EVAL_REFERENCE_BACKEND", "onnx")
+    backend = os.getenv("EVAL_BACKEND", "onnx-int8")
+    batch_size = max(1, int(os.getenv("YOLO_BATCH_SIZE", 8)))
+
+    ims = read_frames(path, frames)
+    logging.info(
+        f"Evaluating {backend} against {reference_backend} on {len(ims)} frames"
+    )
+    report = quantization_report(ims, reference_backend, backend, batch_size)
+    logging.info(json.dumps(report, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import os
+import torch
+import numpy as np
+
+from time import time
+
+from models.experimental import attempt_load
+from utils.datasets import letterbox
+from utils.general import (
+    non_max_suppression,
+    scale_coords,
+)
+from utils.torch_utils import select_device
+
+from object_detection.preprocess import InputBuffers
+
+
+def letterbox_geometry(im0_shape, im_size):
+    """Calculate geometry of the letterbox of yolov5 for an image shape,
+    padded to the smallest rectangle fitting the image
+
+    Args:
+        im0_shape (Tuple): Shape of the input image
+        im_size (int): Input size of the model
+
+    Returns:
+        Tuple(Tuple, Tuple, Tuple): Letterboxed shape, padding (top, left) and
+            resized shape, each as (height, width)
+    """
+    height, width = im0_shape[:2]
+    im, ratio, (dw, dh) = letterbox(
+        np.zeros((height, width, 3), dtype=np.uint8), new_shape=(im_size, im_size)
+    )
+    top, left = int(round(dh - 0.1)), int(round(dw - 0.1))
+    resized = int(round(height * ratio[1])), int(round(width * ratio[0]))
+    return im.shape[:2], (top, left), resized
+
+
+class TorchBackend:
+    def __init__(self, weights, im_size, torchscript_path="", im0_shape=None):
+        """YOLOv5 model run with PyTorch, on GPU if available. With a TorchScript
+        path, the model is traced once for each letterboxed input shape and
+        cached to disk, and later runs load the traced model instead of the
+        PyTorch weights.
+
+        Args:
+            weights (str): Path of the PyTorch weights
+            im_size (int): Input size of the model
+            torchscript_path (str, optional): Path of the traced models, the
+                letterboxed shape and device are appended to the file name.
+                Defaults to "", running the PyTorch weights.
+            im0_shape (Tuple, optional): Shape of the detected images, the model
+                is prepared and warmed up for their letterboxed shape. Defaults
+                to None, warming up a square input.
+        """
+        start = time()
+        # Initialize
+        if torch.cuda.is_available():
+            self.device = select_device("0")
+        else:
+            self.device = select_device("cpu")
+
+        self.weights = weights
+        self.torchscript_path = torchscript_path
+        self.im_size = im_size
+        self.model = None
+        # traced models by letterboxed shape
+        self.modules = {}
+        shape = (self.im_size, self.im_size)
+        if im0_shape is not None:
+            shape = letterbox_geometry(im0_shape, self.im_size)[0]
+        if torchscript_path:
+            model = self._module(shape)
+        else:
+            model = self._load_weights()
+
+        im_pt = torch.zeros((1, 3) + tuple(shape), device=self.device)  # init image
+        _ = model(im_pt.half() if torch.cuda.is_available() else im_pt)
+        logging.info("Model loaded in {}s".format(round(time() - start, 2)))
+
+        # module level function, passed from detection workers to the pool
+        self.letterbox_geometry = letterbox_geometry
+        # inputs are prepared in pinned memory for fast transfer to the GPU
+        self.buffers = InputBuffers(
+            letterbox_geometry,
+            self._allocate,
+            np.float16 if torch.cuda.is_available() else np.float32,
+        )
+
+    def _load_weights(self):
+        """Load the PyTorch weights
+
+        Returns:
+            torch.nn.Module: Model
+        """
+        if self.model is None:
+            logging.info("Loading model: {}".format(self.weights))
+            # traced models record the weights they were traced from
+            self.weights_signature = self._weights_signature()
+            self.model = attempt_load(self.weights, map_location=self.device)
+            if torch.cuda.is_available():
+                self.model.half()
+
+            # Get names and colors
+            self.names = (
+                self.model.module.names
+                if hasattr(self.model, "module")
+                else self.model.names
+            )
+        return self.model
+
+    def _weights_signature(self):
+        """Identify the PyTorch weights traced models are created from
+
+        Returns:
+            str: Size and modification time of the weights, empty if the
+                 weights do not exist
+        """
+        if not os.path.exists(self.weights):
+            return ""
+        stat = os.stat(self.weights)
+        return json.dumps({"size": stat.st_size, "mtime_ns": stat.st_mtime_ns})
+
+    def _module(self, shape):
+        """Retrieve traced model of a letterboxed input shape, loading it from
+        disk or tracing it from the PyTorch weights if needed. A traced model
+        is traced again if the weights have been replaced after tracing.
+
+        Args:
+            shape (Tuple): Height and width of the model input
+
+        Returns:
+            torch.jit.ScriptModule: Traced model
+        """
+        shape = tuple(shape)
+        if shape in self.modules:
+            return self.modules[shape]
+
+        root, ext = os.path.splitext(self.torchscript_path)
+        path = f"{root}_{shape[0]}x{shape[1]}_{self.device.type}{ext}"
+        signature = self._weights_signature()
+        extra_files = {"names.json": "", "weights.json": ""}
+        module = None
+        if os.path.exists(path):
+            logging.info("Loading model: {}".format(path))
+            module = torch.jit.load(
+                path, map_location=self.device, _extra_files=extra_files
+            )
+            if signature and extra_files["weights.json"] != signature:
+                logging.info("Weights have changed since tracing: {}".format(path))
+                module = None
+            else:
+                self.names = json.loads(extra_files["names.json"])
+        if module is None:
+            model = self._load_weights()
+            logging.info("Tracing model to: {}".format(path))
+            im_pt = torch.zeros((1, 3) + shape, device=self.device)
+            with torch.no_grad():
+                module = torch.jit.trace(
+                    model,
+                    im_pt.half() if torch.cuda.is_available() else im_pt,
+                    check_trace=False,
+                    strict=False,
+                )
+            # several processes may trace the same shape, replace atomically
+            extra_files["names.json"] = json.dumps(self.names)
+            extra_files["weights.json"] = self.weights_signature
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            torch.jit.save(module, tmp_path, _extra_files=extra_files)
+            os.replace(tmp_path, path)
+        self.modules[shape] = module
+        return module
+
+    def _allocate(self, shape):
+        """Allocate a model input array
+
+        Args:
+            shape (Tuple): Shape of the array
+
+        Returns:
+            numpy.ndarray: Array sharing memory with a tensor
+        """
+        if torch.cuda.is_available():
+            return torch.empty(shape, dtype=torch.float16, pin_memory=True).numpy()
+        return torch.empty(shape, dtype=torch.float32).numpy()
+
+    def letterbox(self, im0, im_size):
+        """Resize and pad image to the input size of the model, to the smallest
+        rectangle fitting the image
+
+        Args:
+            im0 (numpy.ndarray): Input image
+            im_size (int): Input size of the model
+
+        Returns:
+            numpy.ndarray: Letterboxed image
+        """
+        return letterbox(im0, new_shape=(im_size, im_size))[0]
+
+    def detect(self, im, im0_shapes, conf_thres, iou_thres, classes=None):
+        """Perform object detection for a batch of letterboxed images
+
+        Args:
+            im (numpy.ndarray): Model input from self.buffers
+            im0_shapes (List): Shapes of the original images
+            conf_thres (float): Confidence threshold
+            iou_thres (float): IoU threshold of non-maximum suppression
+            classes (List, optional): Indices of detected classes. Defaults to None,
+                detecting all classes.
+
+        Returns:
+            List: Array of detections for each image, rows containing
+                  rounded bounding box in original image coordinates,
+                  confidence and class index
+        """
+        with torch.no_grad():
+
+            # Run inference, input is already RGB and scaled to 0.0 - 1.0
+            im_pt = torch.from_numpy(im).to(self.device, non_blocking=True)
+
+            # Inference
+            if self.torchscript_path:
+                pred = self._module(im_pt.shape[2:])(im_pt)[0]
+            else:
+                pred = self.model(im_pt)[0]
+
+            # Apply NMS
+            pred = non_max_suppression(
+                pred,
+                conf_thres=conf_thres,
+                iou_thres=iou_thres,
+                merge=False,
+                classes=classes,
+                agnostic=True,
+            )
+
+            counts = [len(p) if p is not None else 0 for p in pred]
+            if not sum(counts):
+                return [np.zeros((0, 6), dtype=np.float32) for _ in pred]
+            pred_all = torch.cat([p for p in pred if p is not None])
+
+            # Rescale boxes from img_size to im0 size, at once if shapes match
+            if all(shape == im0_shapes[0] for shape in im0_shapes):
+                scale_coords(im_pt.shape[2:], pred_all[:, :4], im0_shapes[0])
+            else:
+                start = 0
+                for count, im0_shape in zip(counts, im0_shapes):
+                    scale_coords(
+                        im_pt.shape[2:], pred_all[start : start + count, :4], im0_shape
+                    )
+                    start += count
+            pred_all[:, :4] = pred_all[:, :4].round()
+
+            # single transfer to host for the whole batch
+            return np.split(pred_all.cpu().numpy(), np.cumsum(counts)[:-1])
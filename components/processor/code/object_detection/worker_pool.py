@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+
+import ctypes
+import logging
+import multiprocessing
+import os
+import queue
+import numpy as np
+
+from object_detection.detections import (
+    DETECTION_DTYPE,
+    detections_to_dicts,
+)
+from object_detection.preprocess import apply_letterbox
+
+
+def _worker(create_detector, slots, tasks, results, threads):
+    """Detection worker process. Loads the detector once, and detects objects
+    in images read from a shared memory slot until None is received.
+
+    Args:
+        create_detector (Callable): Function creating the detector
+        slots (List): Shared memory slots holding the images of a batch
+        tasks (multiprocessing.Queue): Batches to detect
+        results (multiprocessing.Queue): Detections of each batch
+        threads (int): Number of threads used by the inference library
+    """
+    logging.basicConfig(level=logging.INFO)
+    # workers share the cores instead of each using all of them
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    try:
+        detector = create_detector()
+    except Exception as e:
+        logging.error(f"Could not load detector: {str(e)}")
+        results.put((None, None))
+        return
+    # the pool letterboxes images with the geometry of the backend
+    results.put((None, (detector.names, detector.im_size, detector.letterbox_geometry)))
+
+    buffers = [np.frombuffer(slot, dtype=np.uint8) for slot in slots]
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        ticket, slot, layout, im0_shapes, im_size = task
+        ims = [
+            buffers[slot][offset : offset + int(np.prod(shape))].reshape(shape)
+            for offset, shape in layout
+        ]
+        try:
+            if im_size is None:
+                detections = detector.detect_letterboxed_batch_arrays(ims, im0_shapes)
+            else:
+                detections = detector.detect_batch_arrays(ims, im_size)
+        except Exception as e:
+            logging.error(f"Object detection failed: {str(e)}")
+            detections = [np.zeros(0, dtype=DETECTION_DTYPE) for _ in ims]
+        results.put((ticket, detections))
+
+
+class DetectionPool:
+    def __init__(self, create_detector, workers, slot_bytes):
+        """Pool of object detection processes, each loading the detector once.
+        Images are passed to the workers through shared memory slots, and
+        detections are returned in the order the batches were submitted.
+        Blocks until every worker has loaded the detector.
+
+        Args:
+            create_detector (Callable): Picklable function creating the detector,
+                e.g. functools.partial of object_detection.yolo.Yolov5
+            workers (int): Number of worker processes
+            slot_bytes (int): Size of the largest batch of images in bytes
+        """
+        # spawned workers do not inherit the CUDA context or threads of the parent
+        context = multiprocessing.get_context("spawn")
+        self.slot_bytes = slot_bytes
+        # two batches per worker, the next batch is copied while one is detected
+        slots = [
+            context.RawArray(ctypes.c_uint8, slot_bytes) for _ in range(2 * workers)
+        ]
+        self.buffers = [np.frombuffer(slot, dtype=np.uint8) for slot in slots]
+        self.free_slots = list(range(len(slots)))
+        self.tasks = context.Queue()
+        self.results = context.Queue()
+        self.submitted = 0
+        self.returned = 0
+        # ticket -> (slot, detections), detections is None while pending
+        self.batches = {}
+        # letterbox geometry by image shape and input size
+        self.geometries = {}
+
+        threads = max(1, multiprocessing.cpu_count() // workers)
+        self.processes = [
+            context.Process(
+                target=_worker,
+                args=(create_detector, slots, self.tasks, self.results, threads),
+                daemon=True,
+            )
+            for _ in range(workers)
+        ]
+        for process in self.processes:
+            process.start()
+
+        for _ in self.processes:
+            try:
+                _, ready = self._get()
+            except RuntimeError:
+                ready = None
+            if ready is None:
+                self.close()
+                raise RuntimeError("Object detection worker could not be started")
+            self.names, self.im_size, self.letterbox_geometry = ready
+        logging.info(f"Started {workers} object detection workers")
+
+    def letterbox_image(self, im0, im_size=None):
+        """Resize and pad image to the input size of the detector, with the
+        letterbox geometry of the backend run by the workers
+
+        Args:
+            im0 (numpy.ndarray): Input image from which objects are detected
+            im_size (int, optional): Input size. Defaults to im_size of the detector.
+
+        Returns:
+            numpy.ndarray: Letterboxed image
+        """
+        key = (im0.shape[:2], im_size or self.im_size)
+        if key not in self.geometries:
+            self.geometries[key] = self.letterbox_geometry(*key)
+        return apply_letterbox(im0, self.geometries[key])
+
+    def detections_to_dicts(self, detections):
+        """Convert detection records to detection dictionaries
+
+        Args:
+            detections (numpy.ndarray): DETECTION_DTYPE records
+
+        Returns:
+            List: Object detection results as a list of dictionaries containing
+                  bounding boxes, confidence and label
+        """
+        return detections_to_dicts(detections, self.names)
+
+    def submit_batch(self, im0s, im_size=None):
+        """Submit images for object detection, blocking while all shared memory
+        slots are in use
+
+        Args:
+            im0s (List): Input images from which objects are detected
+            im_size (int, optional): Input size. Defaults to im_size of the detector.
+
+        Returns:
+            int: Ticket of the batch
+        """
+        return self._submit(im0s, None, im_size or self.im_size)
+
+    def submit_letterboxed_batch(self, ims, im0_shapes):
+        """Submit letterboxed images for object detection, blocking while all
+        shared memory slots are in use
+
+        Args:
+            ims (List): Letterboxed images
+            im0_shapes (List): Shapes of the original images
+
+        Returns:
+            int: Ticket of the batch
+        """
+        return self._submit(ims, [tuple(shape) for shape in im0_shapes], None)
+
+    def _submit(self, ims, im0_shapes, im_size):
+        """Copy images to a free shared memory slot and queue them for detection
+
+        Args:
+            ims (List): Images
+            im0_shapes (List or None): Shapes of the original images of
+                letterboxed images
+            im_size (int or None): Input size, None for letterboxed images
+
+        Returns:
+            int: Ticket of the batch
+        """
+        if sum(im.nbytes for im in ims) > self.slot_bytes:
+            raise ValueError("Batch does not fit in shared memory slot")
+        while not self.free_slots:
+            self._receive()
+        slot = self.free_slots.pop()
+
+        layout = []
+        offset = 0
+        for im in ims:
+            if im.dtype != np.uint8:
+                raise ValueError("Only uint8 images can be detected")
+            self.buffers[slot][offset : offset + im.nbytes].reshape(im.shape)[...] = im
+            layout.append((offset, im.shape))
+            offset += im.nbytes
+
+        ticket = self.submitted
+        self.submitted += 1
+        self.batches[ticket] = (slot, None)
+        self.tasks.put((ticket, slot, layout, im0_shapes, im_size))
+        return ticket
+
+    def _get(self):
+        """Wait for a message from the workers, raising RuntimeError if a
+        worker process has exited
+
+        Returns:
+            Tuple: Ticket and detections of a batch
+        """
+        while True:
+            try:
+                return self.results.get(timeout=1)
+            except queue.Empty:
+                if not all(process.is_alive() for process in self.processes):
+                    raise RuntimeError("Object detection worker has exited")
+
+    def _receive(self):
+        """Wait for detections of any batch and release its slot"""
+        ticket, detections = self._get()
+        slot, _ = self.batches[ticket]
+        self.batches[ticket] = (slot, detections)
+        self.free_slots.append(slot)
+
+    def pending(self):
+        """Count batches submitted but not yet returned by result
+
+        Returns:
+            int: Number of batches
+        """
+        return self.submitted - self.returned
+
+    def result(self):
+        """Wait for detections of the oldest submitted batch. Workers may finish
+        batches in any order, results are kept until their turn.
+
+        Returns:
+            List: DETECTION_DTYPE records of the detections of each image
+        """
+        if not self.pending():
+            raise ValueError("No batches submitted")
+        while self.batches[self.returned][1] is None:
+            self._receive()
+        _, detections = self.batches.pop(self.returned)
+        self.returned += 1
+        return detections
+
+    def close(self):
+        """Stop the worker processes"""
+        for _ in self.processes:
+            self.tasks.put(None)
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        # allow the interpreter to exit without flushing results never read
+        for q in (self.tasks, self.results):
+            q.cancel_join_thread()
+            q.close()
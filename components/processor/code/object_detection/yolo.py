@@ -2,56 +2,92 @@
 
 import logging
 import os
-import torch
-import numpy as np
-
-from models.experimental import attempt_load
-from utils.datasets import letterbox
-from utils.general import (
-    non_max_suppression,
-    scale_coords,
+
+from object_detection.detections import detection_records, detections_to_dicts
+
+
+YOLO5_WEIGHTS = os.getenv("YOLO5_WEIGHTS", "/tmp/yolov5l.pt")
+YOLO_BACKEND = os.getenv("YOLO_BACKEND", "torch")
+YOLO_ONNX_WEIGHTS = os.getenv(
+    "YOLO_ONNX_WEIGHTS", os.path.splitext(YOLO5_WEIGHTS)[0] + ".onnx"
+)
+YOLO_INT8_WEIGHTS = os.getenv(
+    "YOLO_INT8_WEIGHTS", os.path.splitext(YOLO_ONNX_WEIGHTS)[0] + ".int8.onnx"
+)
+YOLO_CALIBRATION_PATH = os.getenv("YOLO_CALIBRATION_PATH", "")
+YOLO_TORCHSCRIPT = os.getenv("YOLO_TORCHSCRIPT", "true").lower() == "true"
+YOLO_TORCHSCRIPT_WEIGHTS = os.getenv(
+    "YOLO_TORCHSCRIPT_WEIGHTS", os.path.splitext(YOLO5_WEIGHTS)[0] + ".torchscript.pt"
 )
-from utils.torch_utils import select_device
 
 
 class Yolov5:
-    def __init__(self):
+    def __init__(self, backend=YOLO_BACKEND, classes=None, im0_shape=None):
         """Object detection based on YOLOv5 algorithm.
 
         See details:
         https://github.com/ultralytics/yolov5
+
+        Args:
+            backend (str, optional): Inference backend, "torch", "onnx" or
+                "onnx-int8".
+                Defaults to YOLO_BACKEND environment variable or "torch".
+            classes (List, optional): Labels of detected classes. Defaults to None,
+                detecting all classes.
+            im0_shape (Tuple, optional): Shape of the detected images, the torch
+                backend is warmed up for their input shape. Defaults to None.
         """
         logging.basicConfig(level=logging.INFO)
 
-        # Initialize
-        if torch.cuda.is_available():
-            self.device = select_device("0")
+        self.im_size = 640
+        self.conf_thres = 0.4
+        self.iou_thres = 0.5
+
+        # backends are imported on demand, the onnx backend runs without torch
+        if backend == "onnx":
+            from object_detection.onnx_backend import OnnxBackend
+
+            self.backend = OnnxBackend(YOLO5_WEIGHTS, YOLO_ONNX_WEIGHTS, self.im_size)
+        elif backend == "onnx-int8":
+            from object_detection.onnx_backend import OnnxBackend
+
+            self.backend = OnnxBackend(
+                YOLO5_WEIGHTS,
+                YOLO_ONNX_WEIGHTS,
+                self.im_size,
+                int8_path=YOLO_INT8_WEIGHTS,
+                calibration_path=YOLO_CALIBRATION_PATH,
+            )
         else:
-            self.device = select_device("cpu")
-
-        # Load model
-        logging.info(
-            "Loading model: {}".format(os.getenv("YOLO5_WEIGHTS", "/tmp/yolov5l.pt"))
-        )
-        self.model = attempt_load(
-            os.getenv("YOLO5_WEIGHTS", "/tmp/yolov5l.pt"), map_location=self.device
-        )
-        if torch.cuda.is_available():
-            self.model.half()
+            if backend != "torch":
+                logging.error(f"Unknown YOLO backend {backend}, using torch")
+            from object_detection.torch_backend import TorchBackend
+
+            self.backend = TorchBackend(
+                YOLO5_WEIGHTS,
+                self.im_size,
+                YOLO_TORCHSCRIPT_WEIGHTS if YOLO_TORCHSCRIPT else "",
+                im0_shape,
+            )
 
-        self.im_size = 640
+        self.names = self.backend.names
+        self.letterbox_geometry = self.backend.letterbox_geometry
+        self.classes = None
+        if classes is not None:
+            self.classes = [i for i, name in enumerate(self.names) if name in classes]
+
+    def letterbox_image(self, im0, im_size=None):
+        """Resize and pad image to the input size of the detector. Smaller input
+        sizes are faster to detect, at the cost of accuracy on small objects.
 
-        # Get names and colors
-        self.names = (
-            self.model.module.names
-            if hasattr(self.model, "module")
-            else self.model.names
-        )
+        Args:
+            im0 (numpy.ndarray): Input image from which objects are detected
+            im_size (int, optional): Input size. Defaults to im_size of the detector.
 
-        im_pt = torch.zeros(
-            (1, 3, self.im_size, self.im_size), device=self.device
-        )  # init image
-        _ = self.model(im_pt.half() if torch.cuda.is_available() else im_pt)
+        Returns:
+            numpy.ndarray: Letterboxed image
+        """
+        return self.backend.letterbox(im0, im_size or self.im_size)
 
     def detect(self, im0):
         """Perform object detection for given image
@@ -63,55 +99,121 @@ class Yolov5:
             List: Object detection results as a list of dictionaries containing
                   bounding boxes, confidence and label
         """
-        with torch.no_grad():
-
-            im = letterbox(im0, new_shape=(self.im_size, self.im_size))[0]
-            im = im[:, :, ::-1].transpose(2, 0, 1)  # BGR to RGB
-            im = np.ascontiguousarray(im)
-
-            # Run inference
-            im_pt = torch.from_numpy(im).to(self.device)
-            im_pt = im_pt.half() if torch.cuda.is_available() else im_pt.float()
-            im_pt /= 255.0  # 0 - 255 to 0.0 - 1.0
-            if im_pt.ndimension() == 3:
-                im_pt = im_pt.unsqueeze(0)
-
-            # Inference
-            pred = self.model(im_pt)[0]
-
-            # Apply NMS
-            pred = non_max_suppression(
-                pred,
-                conf_thres=0.4,
-                iou_thres=0.5,
-                merge=False,
-                classes=None,
-                agnostic=True,
+        return self.detect_batch([im0])[0]
+
+    def detect_letterboxed(self, im, im0_shape):
+        """Perform object detection for an image already letterboxed with
+        letterbox_image
+
+        Args:
+            im (numpy.ndarray): Letterboxed image
+            im0_shape (Tuple): Shape of the original image
+
+        Returns:
+            List: Object detection results as a list of dictionaries containing
+                  bounding boxes, confidence and label
+        """
+        return self.detect_letterboxed_batch([im], [im0_shape])[0]
+
+    def detect_batch(self, im0s, im_size=None):
+        """Perform object detection for several images in a single forward pass
+
+        Args:
+            im0s (List): Input images from which objects are detected
+            im_size (int, optional): Input size. Defaults to im_size of the detector.
+
+        Returns:
+            List: Object detection results of each image
+        """
+        return [
+            self.detections_to_dicts(detections)
+            for detections in self.detect_batch_arrays(im0s, im_size)
+        ]
+
+    def detect_letterboxed_batch(self, ims, im0_shapes):
+        """Perform object detection for several letterboxed images in a single
+        forward pass
+
+        Args:
+            ims (List): Letterboxed images
+            im0_shapes (List): Shapes of the original images
+
+        Returns:
+            List: Object detection results of each image as a list of
+                  dictionaries containing bounding boxes, confidence and label
+        """
+        return [
+            self.detections_to_dicts(detections)
+            for detections in self.detect_letterboxed_batch_arrays(ims, im0_shapes)
+        ]
+
+    def detect_batch_arrays(self, im0s, im_size=None):
+        """Perform object detection for several images in a single forward pass.
+        Images are letterboxed directly into a reused model input. Images with
+        differing shapes are run separately.
+
+        Args:
+            im0s (List): Input images from which objects are detected
+            im_size (int, optional): Input size. Defaults to im_size of the detector.
+
+        Returns:
+            List: DETECTION_DTYPE records of the detections of each image
+        """
+        if not im0s:
+            return []
+        if any(im0.shape != im0s[0].shape for im0 in im0s):
+            return [self.detect_batch_arrays([im0], im_size)[0] for im0 in im0s]
+
+        im = self.backend.buffers.from_frames(im0s, im_size or self.im_size)
+        return self._detect(im, [im0.shape for im0 in im0s])
+
+    def detect_letterboxed_batch_arrays(self, ims, im0_shapes):
+        """Perform object detection for several letterboxed images in a single
+        forward pass. Images with differing letterbox shapes are run separately.
+
+        Args:
+            ims (List): Letterboxed images
+            im0_shapes (List): Shapes of the original images
+
+        Returns:
+            List: DETECTION_DTYPE records of the detections of each image
+        """
+        if not ims:
+            return []
+        if any(im.shape != ims[0].shape for im in ims):
+            return [
+                self.detect_letterboxed_batch_arrays([im], [im0_shape])[0]
+                for im, im0_shape in zip(ims, im0_shapes)
+            ]
+
+        im = self.backend.buffers.from_letterboxed(ims)
+        return self._detect(im, im0_shapes)
+
+    def _detect(self, im, im0_shapes):
+        """Run the backend for a prepared model input
+
+        Args:
+            im (numpy.ndarray): Model input of shape (batch, 3, height, width)
+            im0_shapes (List): Shapes of the original images
+
+        Returns:
+            List: DETECTION_DTYPE records of the detections of each image
+        """
+        return [
+            detection_records(detections)
+            for detections in self.backend.detect(
+                im, im0_shapes, self.conf_thres, self.iou_thres, self.classes
             )
+        ]
 
-            detections = []
-
-            # Process detections
-            raw_predictions = pred[0]
-
-            if raw_predictions is not None:
-                for i in range(raw_predictions.shape[0]):
-                    detection = {}
-
-                    # Rescale boxes from img_size to im0 size
-                    detection["bbox"] = (
-                        scale_coords(
-                            im_pt.shape[2:], raw_predictions[i : i + 1, :4], im0.shape
-                        )
-                        .to("cpu")
-                        .round()[0]
-                        .numpy()
-                        .tolist()
-                    )
-                    detection["confidence"] = (
-                        raw_predictions[i, -2].to("cpu").numpy().tolist()
-                    )
-                    detection["label"] = self.names[int(raw_predictions[i, -1])]
-                    detections.append(detection)
-
-            return detections
+    def detections_to_dicts(self, detections):
+        """Convert detection records to detection dictionaries
+
+        Args:
+            detections (numpy.ndarray): DETECTION_DTYPE records
+
+        Returns:
+            List: Object detection results as a list of dictionaries containing
+                  bounding boxes, confidence and label
+        """
+        return detections_to_dicts(detections, self.names)
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+
+import logging
+
+from collections import deque
+from threading import Condition
+
+
+DROP_OLDEST = "drop-oldest"
+DROP_NEWEST = "drop-newest"
+DOWNSAMPLE_BLOCK = "downsample-block"
+DROP_POLICIES = (DROP_OLDEST, DROP_NEWEST, DOWNSAMPLE_BLOCK)
+
+
+def block_nbytes(block):
+    """Calculate memory used by the frames of a block
+
+    Args:
+        block (List): List of processor.frame.Frame objects
+
+    Returns:
+        int: Size of the block in bytes
+    """
+    return sum(frame.nbytes for frame in block)
+
+
+def block_seconds(block, default=0.0):
+    """Calculate time span covered by the frames of a block
+
+    Args:
+        block (List): List of processor.frame.Frame objects
+        default (float, optional): Duration if frame dates are not available. Defaults to 0.0.
+
+    Returns:
+        float: Duration of the block in seconds
+    """
+    try:
+        return (block[-1].frame_date - block[0].frame_date).total_seconds()
+    except Exception:
+        return default
+
+
+class BlockQueue:
+    def __init__(
+        self, max_bytes, drop_policy=DROP_NEWEST, block_seconds_default=2.5, spill=None
+    ):
+        """Thread safe queue of frame blocks passed from motion detection to
+        object detection. The frames held by the queue are limited by a memory
+        budget, and a drop policy decides what to discard when a new block does
+        not fit:
+
+        - drop-oldest: discard the oldest queued blocks
+        - drop-newest: discard the new block
+        - downsample-block: discard every other frame of the new block until it
+          fits, and discard it if even a single frame does not fit
+
+        With a disk spill, blocks which do not fit in memory are written to disk
+        first, and the drop policy applies only when the disk budget is used too.
+        While there are blocks on disk, new blocks are spilled as well, so that
+        blocks are always returned in the order they were added.
+
+        Args:
+            max_bytes (int): Memory budget of queued frames in bytes
+            drop_policy (str, optional): Drop policy. Defaults to "drop-newest".
+            block_seconds_default (float, optional): Duration used for blocks without
+                frame dates. Defaults to 2.5.
+            spill (processor.disk_spill.DiskSpill, optional): Overflow storage on disk.
+                Defaults to None.
+        """
+        if drop_policy not in DROP_POLICIES:
+            logging.error(f"Unknown drop policy {drop_policy}, using {DROP_NEWEST}")
+            drop_policy = DROP_NEWEST
+
+        self.max_bytes = max_bytes
+        self.drop_policy = drop_policy
+        self.block_seconds_default = block_seconds_default
+        self.spill = spill
+        self.condition = Condition()
+        self.blocks = deque()
+        self.nbytes = 0
+        self.seconds = 0.0
+        self.frames_in = 0
+        self.dropped_frames = 0
+        self.dropped_blocks = 0
+        self.spilled_blocks = 0
+
+    def __len__(self):
+        return len(self.blocks) + self._spilled()
+
+    def _spilled(self):
+        return len(self.spill) if self.spill is not None else 0
+
+    def _append(self, block, nbytes, seconds):
+        self.blocks.append((block, nbytes, seconds))
+        self.nbytes += nbytes
+        self.seconds += seconds
+
+    def _popleft(self):
+        block, nbytes, seconds = self.blocks.popleft()
+        self.nbytes -= nbytes
+        self.seconds -= seconds
+        return block
+
+    def _drop(self, frames):
+        self.dropped_frames += frames
+        self.dropped_blocks += 1
+
+    def put(self, block):
+        """Add a block to the queue without blocking. Frames are dropped
+        according to the drop policy if the memory budget is exceeded.
+
+        Args:
+            block (List): List of processor.frame.Frame objects
+
+        Returns:
+            bool: True if the block or a part of it was queued
+        """
+        if not block:
+            return False
+
+        nbytes = block_nbytes(block)
+        seconds = block_seconds(block, self.block_seconds_default)
+        if self.spill is not None and (
+            self._spilled() or self.nbytes + nbytes > self.max_bytes
+        ):
+            # disk is written outside of the lock, only this thread adds blocks
+            if self.spill.write(block, seconds):
+                with self.condition:
+                    self.frames_in += len(block)
+                    self.spilled_blocks += 1
+                    self.condition.notify()
+                return True
+
+            if self._spilled():
+                # memory can not be used before blocks on disk are processed
+                with self.condition:
+                    self.frames_in += len(block)
+                    self._drop(len(block))
+                return False
+
+        with self.condition:
+            self.frames_in += len(block)
+
+            if self.drop_policy == DOWNSAMPLE_BLOCK:
+                while self.nbytes + nbytes > self.max_bytes and len(block) > 1:
+                    self.dropped_frames += len(block) - len(block[::2])
+                    block = block[::2]
+                    nbytes = block_nbytes(block)
+
+            if self.drop_policy == DROP_OLDEST:
+                while self.blocks and self.nbytes + nbytes > self.max_bytes:
+                    self._drop(len(self._popleft()))
+
+            if self.nbytes + nbytes > self.max_bytes:
+                self._drop(len(block))
+                return False
+
+            self._append(block, nbytes, seconds)
+            self.condition.notify()
+            return True
+
+    def get(self, timeout=None):
+        """Remove and return the oldest block. Waits until a block is available.
+
+        Args:
+            timeout (float, optional): Maximum time to wait in seconds. Defaults to None.
+
+        Returns:
+            List or None: List of processor.frame.Frame objects, None on timeout
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: len(self) > 0, timeout):
+                return None
+            if self.blocks:
+                return self._popleft()
+            filename = self.spill.pop()
+        # disk is read outside of the lock, so adding blocks is not stalled
+        return self.spill.load(filename)
+
+    def clear(self):
+        """Remove all blocks from the queue"""
+        with self.condition:
+            self.blocks.clear()
+            self.nbytes = 0
+            self.seconds = 0.0
+            if self.spill is not None:
+                self.spill.clear()
+
+    def queued_seconds(self):
+        """Return the time span of video waiting in the queue
+
+        Returns:
+            float: Sum of block durations in seconds
+        """
+        if self.spill is not None:
+            return self.seconds + self.spill.seconds
+        return self.seconds
+
+    def statistics(self):
+        """Retrieve queue statistics
+
+        Returns:
+            dict: Queued blocks, memory and seconds, and dropped frames and blocks
+        """
+        with self.condition:
+            statistics = {
+                "blocks": len(self.blocks),
+                "queued_mb": round(self.nbytes / (1024 * 1024), 1),
+                "queued_seconds": round(self.queued_seconds(), 1),
+                "dropped_frames": self.dropped_frames,
+                "dropped_blocks": self.dropped_blocks,
+            }
+            if self.spill is not None:
+                statistics["spilled_blocks"] = self.spilled_blocks
+                statistics["blocks_on_disk"] = len(self.spill)
+                statistics["disk_mb"] = round(self.spill.nbytes / (1024 * 1024), 1)
+            return statistics
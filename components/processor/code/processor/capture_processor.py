@@ -1,29 +1,61 @@
 # -*- coding: utf-8 -*-
 
 import cv2
-import imagehash
-import json
 import logging
 import os
 import numpy as np
 
+from collections import deque
 from datetime import datetime
+from functools import partial
 from threading import Thread
 from time import time, sleep
-from PIL import Image
 
-from sort.sort import Sort
+from sort.batch_sort import BatchSort
 
+from processor.block_queue import BlockQueue
+from processor.disk_spill import DiskSpill
+from processor.frame import Frame
 from processor.mask import Mask
+from processor.motion import get_motion_detector
 from processor.warp import Warp
-from crypt import encrypt_image
+from processor.writer_pool import WriterPool
+from object_detection.detections import DETECTION_DTYPE, VALID_VEHICLE_CLASSES
+from object_detection.worker_pool import DetectionPool
 from object_detection.yolo import Yolov5
 
 
-VALID_VEHICLE_CLASSES = ["car", "motorcycle", "bus", "truck"]
 ENCRYPT = False
 DEFAULT_SKIPRATE = 45
 DEBUG = os.getenv("DEBUG", "false").lower() == "true"
+WARP_INTERPOLATION = os.getenv("WARP_INTERPOLATION", "cubic").lower()
+MOTION_DETECTOR = os.getenv("MOTION_DETECTOR", "phash").lower()
+MOTION_ADAPTIVE_THRESHOLD = (
+    os.getenv("MOTION_ADAPTIVE_THRESHOLD", "false").lower() == "true"
+)
+MOTION_CHECK_INTERVAL = max(1, int(os.getenv("MOTION_CHECK_INTERVAL", 1)))
+MOTION_PRE_ROLL = int(os.getenv("MOTION_PRE_ROLL", 0))
+QUEUE_MEMORY_MB = int(os.getenv("QUEUE_MEMORY_MB", 8192))
+QUEUE_DROP_POLICY = os.getenv("QUEUE_DROP_POLICY", "drop-newest").lower()
+SPILL_PATH = os.getenv("SPILL_PATH", "")
+SPILL_MAX_MB = int(os.getenv("SPILL_MAX_MB", 65536))
+COMPACT_FRAMES = os.getenv("COMPACT_FRAMES", "false").lower() == "true"
+YOLO_BATCH_SIZE = max(1, int(os.getenv("YOLO_BATCH_SIZE", 8)))
+YOLO_WORKERS = max(0, int(os.getenv("YOLO_WORKERS", 0)))
+YOLO_INPUT_SIZES = sorted(
+    {int(size) for size in os.getenv("YOLO_INPUT_SIZES", "640").split(",")},
+    reverse=True,
+)
+YOLO_DOWNSIZE_LAG = float(os.getenv("YOLO_DOWNSIZE_LAG", 60))
+YOLO_UPSIZE_LAG = float(os.getenv("YOLO_UPSIZE_LAG", 15))
+DETECTION_INTERVAL_MAX = max(1, int(os.getenv("DETECTION_INTERVAL_MAX", 1)))
+DETECTION_INTERVAL_LAG = float(os.getenv("DETECTION_INTERVAL_LAG", 20))
+DETECTION_CROP = os.getenv("DETECTION_CROP", "false").lower() == "true"
+DETECTION_CROP_PADDING = int(os.getenv("DETECTION_CROP_PADDING", 64))
+WRITER_WORKERS = max(0, int(os.getenv("WRITER_WORKERS", 4)))
+WRITER_QUEUE_SIZE = max(1, int(os.getenv("WRITER_QUEUE_SIZE", 64)))
+ROI_OUTPUT = os.getenv("ROI_OUTPUT", "all").lower()
+ROI_OUTPUTS = ["all", "detections", "motion"]
 
 
 class CaptureProcessor:
@@ -51,7 +83,7 @@ class CaptureProcessor:
             cap (cv2.VideoCapture): OpenCV's VideoCapture object for either camera or video stream
             mask_filename (str): Filename of mask file in PNG format
             warp_filename (str): Filename of warp file in JSON format
-            threshold (int): Threshold for perceptual hash to detect motion in ROI
+            threshold (int): Threshold for motion score to detect motion in ROI
             prefix (str, optional): Prefix for image and metadata files. Defaults to "".
             output_path (str, optional): Folder to save images and metadata. Defaults to "crop_images".
         """
@@ -62,23 +94,79 @@ class CaptureProcessor:
         self.output_path = output_path
         self.mask_filename = mask_filename
         self.warp_filename = warp_filename
-        self.image_cache = []
         self.keep_sending_after_phash_diff = 2.5  # seconds
-        self.yolo = Yolov5()
-        self.tracker = Sort(max_age=5, min_hits=3, iou_threshold=0.3)
+        spill = None
+        if SPILL_PATH:
+            spill = DiskSpill(
+                os.path.join(SPILL_PATH, prefix),
+                SPILL_MAX_MB * (1024 * 1024),
+                self._load_frame,
+            )
+        self.image_cache = BlockQueue(
+            QUEUE_MEMORY_MB * (1024 * 1024),
+            QUEUE_DROP_POLICY,
+            self.keep_sending_after_phash_diff,
+            spill,
+        )
+        # check motion every Nth frame, unchecked frames wait in pre-roll buffer
+        self.motion_check_interval = MOTION_CHECK_INTERVAL
+        self.pre_roll_length = max(MOTION_PRE_ROLL, MOTION_CHECK_INTERVAL - 1)
+        self.motion = None
+        self.frames_captured = 0
+        # object detection is loaded when processing is started the first time
+        self.yolo = None
+        self.yolo_thread = None
+        # ROI images and metadata are written in the background
+        self.writer = None
+        # start of processing and the first block after it are timed until
+        # the first processed frame, None once logged
+        self.started = None
+        self.first_block_started = None
+        # index to YOLO_INPUT_SIZES, larger when behind
+        self.input_size_index = 0
+        # part of the frame passed to object detection
+        self.detection_slice = (slice(None), slice(None))
+        self.tracker = BatchSort(max_age=5, min_hits=3, iou_threshold=0.3)
+        # frame number of the last tracked frame, for the time step of the tracker
+        self.tracked_frame_no = None
+        # detect every Nth frame, tracker predicts the frames in between
+        self.detection_interval = 1
+        # label and confidence of the last detection of each track
+        self.track_labels = {}
+        # which ROI images are written, and how many were written or suppressed
+        self.roi_output = ROI_OUTPUT
+        if self.roi_output not in ROI_OUTPUTS:
+            logging.error(f"Unknown ROI output {self.roi_output}, using all")
+            self.roi_output = "all"
+        self.roi_output_counts = {"written": 0, "no_detection": 0, "no_motion": 0}
 
     def start(self):
         """Start processing thread"""
         self.keep_processing = True
+        self.started = time()
+        self.first_block_started = None
         self.mask = Mask(self.mask_filename)
-        self.warp = Warp(self.warp_filename)
+        self.warp = Warp(self.warp_filename, WARP_INTERPOLATION)
+        if DETECTION_CROP:
+            # detections outside ROIs are discarded, no need to look for them
+            self.detection_slice = self.mask.get_detection_slice(DETECTION_CROP_PADDING)
+            logging.info(f"Object detection region: {self.detection_slice}")
+        if self.yolo is None:
+            self.yolo = self._load_detector()
+        if self.writer is None:
+            self.writer = WriterPool(WRITER_WORKERS, WRITER_QUEUE_SIZE, ENCRYPT, DEBUG)
+        self.motion = get_motion_detector(
+            MOTION_DETECTOR, self.mask, self.threshold, MOTION_ADAPTIVE_THRESHOLD
+        )
+        logging.info(
+            "Startup time to detector ready: {}s".format(
+                round(time() - self.started, 2)
+            )
+        )
 
         self.yolo_thread = Thread(target=self._yolo_process, args=())
         self.yolo_thread.daemon = True
         self.yolo_thread.start()
-        previous_roi_hash = [
-            imagehash.phash(Image.fromarray(np.zeros((10, 10))))
-        ] * self.mask.ROI_count()
         try:
             spf = 1 / float(self.cap.get(cv2.CAP_PROP_FPS))
         except Exception:
@@ -87,8 +175,11 @@ class CaptureProcessor:
         frame_no = -1
 
         keep_sending = 0
+        skipped_checks = 0
+        block_motion = None
         frame_cache = []
-        self.image_cache = []
+        pre_roll = deque(maxlen=self.pre_roll_length)
+        self.image_cache.clear()
         frame_date = datetime.now()
         while self.keep_processing:
             # prevent loop lock
@@ -114,187 +205,523 @@ class CaptureProcessor:
             except Exception:
                 frame_date = datetime.now()
 
+            frame = Frame(frame_date, frame_no, im, self.mask, self.warp)
+            self.frames_captured += 1
+
             if time() - keep_sending < self.keep_sending_after_phash_diff:
                 # store frames for X seconds after movement
-                frame_cache.append((frame_date, frame_no, im))
-                im_last = im.copy()
+                # last frame is kept intact for motion reference
+                self._compact(frame_cache[-1:])
+                frame_cache.append(frame)
                 continue
 
             if len(frame_cache) > 0:
+                # set motion reference based on last image in the block
+                self.motion.update(frame_cache[-1])
+                self._compact(frame_cache[-1:])
+                for cached in frame_cache:
+                    cached.roi_motion = block_motion
                 # insert the whole block of frames at once
-                # sanity check, cache can not be too big:
-                # RAM can handle ~ 300 blocks/time to record
-                if len(self.image_cache) < 300 / self.keep_sending_after_phash_diff:
-                    self.image_cache.append(frame_cache)
+                # queue drops frames if its memory budget is exceeded
+                self.image_cache.put(frame_cache)
                 frame_cache = []
-                # set phash based on last image in the block
-                for i, roi_im in enumerate(self.mask.apply_ROIs(im_last)):
-                    roi_im = self.warp.apply(roi_im, i)
-                    roi_hash = imagehash.phash(Image.fromarray(roi_im))
-                    previous_roi_hash[i] = roi_hash
-
-            for i, roi_im in enumerate(self.mask.apply_ROIs(im)):
-                roi_im = self.warp.apply(roi_im, i)
-                roi_hash = imagehash.phash(Image.fromarray(roi_im))
-
-                if previous_roi_hash[i] - roi_hash > self.threshold:
-                    # some ROI contains change, keep caching images!
-                    keep_sending = time()
-                    frame_cache.append((frame_date, frame_no, im))
-                    # break from ROI loop
-                    break
+                logging.info("Motion statistics: {}".format(self.statistics()))
+                # check the first frame after a block
+                skipped_checks = self.motion_check_interval
+
+            if skipped_checks + 1 < self.motion_check_interval:
+                skipped_checks += 1
+                pre_roll.append(frame)
+                continue
+            skipped_checks = 0
+
+            if self.motion.detect(frame):
+                # some ROI contains change, keep caching images!
+                # start the block with frames preceding the movement
+                keep_sending = time()
+                block_motion = self.motion.roi_motion
+                self._compact(pre_roll)
+                frame_cache.extend(pre_roll)
+                pre_roll.clear()
+                frame_cache.append(frame)
+            else:
+                pre_roll.append(frame)
 
     def stop(self):
         """Stop processing thread"""
         self.keep_processing = False
 
+    def release(self):
+        """Wait for the object detection thread to finish the frames it is
+        processing, then release object detection and finish writing ROI
+        images. Called after stop. They are loaded again if processing is
+        restarted."""
+        if self.yolo_thread is not None:
+            self.yolo_thread.join()
+            self.yolo_thread = None
+        if YOLO_WORKERS and self.yolo is not None:
+            self.yolo.close()
+        self.yolo = None
+        if self.writer is not None:
+            self.writer.close()
+        self.writer = None
+
+    def _load_detector(self):
+        """Load object detection in this process, or start detection workers
+
+        Returns:
+            object_detection.yolo.Yolov5 or object_detection.worker_pool.DetectionPool:
+                Object detection
+        """
+        start = time()
+        # the model is warmed up for the detection region of the frames
+        im0_shape = self._detection_shape(self.mask.im.shape[:2] + (3,))
+        if YOLO_WORKERS:
+            # slots fit a batch of detection regions, or of letterboxed images
+            # of the largest input size
+            region = np.prod(im0_shape)
+            letterboxed = 3 * np.square(max(YOLO_INPUT_SIZES + [640]))
+            yolo = DetectionPool(
+                partial(Yolov5, classes=VALID_VEHICLE_CLASSES, im0_shape=im0_shape),
+                YOLO_WORKERS,
+                YOLO_BATCH_SIZE * int(max(region, letterboxed)),
+            )
+        else:
+            yolo = Yolov5(classes=VALID_VEHICLE_CLASSES, im0_shape=im0_shape)
+        logging.info("Object detection loaded in {}s".format(round(time() - start, 2)))
+        return yolo
+
+    def statistics(self):
+        """Retrieve statistics of motion detection and frames sent to object detection
+
+        Returns:
+            dict: Frame counts, share of frames sent to object detection, ROI
+                  images written and suppressed, and motion detector statistics
+        """
+        frames_cached = self.image_cache.frames_in - self.image_cache.dropped_frames
+        statistics = {
+            "frames_captured": self.frames_captured,
+            "frames_cached": frames_cached,
+            "frames_to_yolo_%": round(
+                100 * frames_cached / max(1, self.frames_captured), 1
+            ),
+            "queue": self.image_cache.statistics(),
+            "yolo_input_size": YOLO_INPUT_SIZES[self.input_size_index],
+            "detection_interval": self.detection_interval,
+            "roi_output": dict(self.roi_output_counts),
+        }
+        if self.writer is not None:
+            statistics["writer"] = self.writer.statistics()
+        if self.motion is not None:
+            statistics["motion"] = self.motion.statistics()
+        return statistics
+
+    def _compact(self, frames):
+        """Release captured images of cached frames if compact frames are used.
+        Only ROI images and object detection input are kept.
+
+        Args:
+            frames (Iterable): processor.frame.Frame objects
+        """
+        if not COMPACT_FRAMES:
+            return
+        for frame in frames:
+            frame.compact(
+                lambda im: self.yolo.letterbox_image(im[self.detection_slice])
+            )
+
+    def _select_input_size(self):
+        """Choose the object detection input size based on the queued video.
+        The size is decreased one step when the lag exceeds YOLO_DOWNSIZE_LAG,
+        and increased one step when it falls below YOLO_UPSIZE_LAG, so the size
+        does not flip back and forth.
+
+        Returns:
+            int: Input size of object detection
+        """
+        lag = self.image_cache.queued_seconds()
+        index = self.input_size_index
+        if lag > YOLO_DOWNSIZE_LAG and index < len(YOLO_INPUT_SIZES) - 1:
+            index += 1
+        elif lag < YOLO_UPSIZE_LAG and index > 0:
+            index -= 1
+        if index != self.input_size_index:
+            logging.info(
+                "YOLO input size {} -> {}, lag {}s".format(
+                    YOLO_INPUT_SIZES[self.input_size_index],
+                    YOLO_INPUT_SIZES[index],
+                    round(lag, 1),
+                )
+            )
+            self.input_size_index = index
+        return YOLO_INPUT_SIZES[index]
+
+    def _select_detection_interval(self):
+        """Choose how often object detection is run based on the queued video.
+        The interval grows by one for every DETECTION_INTERVAL_LAG seconds of
+        lag, up to DETECTION_INTERVAL_MAX.
+
+        Returns:
+            int: Object detection is run on every Nth frame
+        """
+        lag = self.image_cache.queued_seconds()
+        interval = min(DETECTION_INTERVAL_MAX, 1 + int(lag / DETECTION_INTERVAL_LAG))
+        if interval != self.detection_interval:
+            logging.info(
+                "Detection interval {} -> {}, lag {}s".format(
+                    self.detection_interval, interval, round(lag, 1)
+                )
+            )
+            self.detection_interval = interval
+        return interval
+
+    def _submit_batch(self, frames, input_size):
+        """Start object detection for several frames in a single forward pass.
+        Without detection workers the detection is run immediately.
+
+        Args:
+            frames (List): processor.frame.Frame objects
+            input_size (int): Input size of object detection
+
+        Returns:
+            int or List: Ticket of the batch in the detection pool, or
+                DETECTION_DTYPE records of the vehicle detections of each frame
+        """
+        if all(frame.im is not None for frame in frames):
+            # letterbox directly into the model input
+            ims = [frame.im[self.detection_slice] for frame in frames]
+            if YOLO_WORKERS:
+                return self.yolo.submit_batch(ims, input_size)
+            return self.yolo.detect_batch_arrays(ims, input_size)
+        else:
+            ims = []
+            for frame in frames:
+                if frame.detector_im is None:
+                    ims.append(
+                        self.yolo.letterbox_image(
+                            frame.im[self.detection_slice], input_size
+                        )
+                    )
+                elif input_size != self.yolo.im_size:
+                    # compact frames keep the input of the default size
+                    ims.append(self.yolo.letterbox_image(frame.detector_im, input_size))
+                else:
+                    ims.append(frame.detector_im)
+            im0_shapes = [self._detection_shape(frame.im_shape) for frame in frames]
+            if YOLO_WORKERS:
+                return self.yolo.submit_letterboxed_batch(ims, im0_shapes)
+            return self.yolo.detect_letterboxed_batch_arrays(ims, im0_shapes)
+
+    def _batch_result(self, batch):
+        """Retrieve vehicle detections of a batch started with _submit_batch.
+        Detection pool returns batches in the order they were submitted.
+
+        Args:
+            batch (int or List): Return value of _submit_batch
+
+        Returns:
+            List: DETECTION_DTYPE records of the vehicle detections of each
+                  frame, bounding boxes in frame coordinates
+        """
+        batch_detections = self.yolo.result() if YOLO_WORKERS else batch
+
+        # map bounding boxes from the detection region to frame coordinates
+        x0 = self.detection_slice[1].start or 0
+        y0 = self.detection_slice[0].start or 0
+        if x0 or y0:
+            for detections in batch_detections:
+                detections["bbox"] += [x0, y0, x0, y0]
+        return batch_detections
+
+    def _detection_shape(self, im_shape):
+        """Calculate shape of the part of a frame passed to object detection
+
+        Args:
+            im_shape (Tuple): Shape of the frame
+
+        Returns:
+            Tuple: Shape of the detection region
+        """
+        rows, cols = self.detection_slice
+        return (
+            len(range(*rows.indices(im_shape[0]))),
+            len(range(*cols.indices(im_shape[1]))),
+        ) + tuple(im_shape[2:])
+
+    def _load_frame(self, frame_date, frame_no, arrays):
+        """Create a frame from image data read from disk spill
+
+        Args:
+            frame_date (datetime.datetime): Capture time of the frame
+            frame_no (int): Running number of the frame
+            arrays (dict): Image data of the frame
+
+        Returns:
+            processor.frame.Frame: Restored frame
+        """
+        return Frame.from_arrays(frame_date, frame_no, arrays, self.mask, self.warp)
+
     def _yolo_process(self):
         """Run YOLO object detection and update tracker"""
         while self.keep_processing:
-            # prevent loop lock
-            sleep(0.01)
-
-            if len(self.image_cache) == 0:
+            # wake up regularly to notice when processing is stopped
+            image_list = self.image_cache.get(timeout=0.5)
+            if image_list is None:
                 continue
             started = time()
-            image_list = self.image_cache.pop(0)
+            if self.started is not None and self.first_block_started is None:
+                self.first_block_started = started
             frames_count = len(image_list)
-            # skip frames if we're much behind
-            # it could be even more sensitive, we used to get every 3rd frame before this
-            # Heuristic model to increase skipping. go to 50% rate quite fast, and top at ~100 cache length
-            try:
-                skip_rate = int(-6 + 21 * np.log(len(self.image_cache) - 0.8))
-            except ValueError:
-                skip_rate = 0
+            # reduce input size first, and skip frames only at the smallest size
+            input_size = self._select_input_size()
+            skip_rate = 0
+            if self.input_size_index == len(YOLO_INPUT_SIZES) - 1:
+                # skip frames if we're much behind
+                # it could be even more sensitive, we used to get every 3rd frame before this
+                # Heuristic model to increase skipping. go to 50% rate quite fast, and top at ~100 cache length
+                try:
+                    skip_rate = int(-6 + 21 * np.log(len(self.image_cache) - 0.8))
+                except ValueError:
+                    skip_rate = 0
             # Skip some frames anyway. we have enough FPS
             skip_rate = max(DEFAULT_SKIPRATE, skip_rate)
             frame_skip = self._discard_n(int(skip_rate), 100)
+            # skip frames if queue starts to get too long
+            frames = [
+                frame
+                for list_index, frame in enumerate(image_list)
+                if frame_skip[list_index % len(frame_skip)] == 0
+            ]
+            interval = self._select_detection_interval()
             timestamp = ""
-            for list_index, (frame_date, frame_no, im) in enumerate(image_list):
-                if frame_skip[list_index % len(frame_skip)] == 1:
-                    # skip frames if queue starts to get too long
-                    continue
+            # each chunk holds YOLO_BATCH_SIZE detected frames and the predicted
+            # frames following them
+            chunk_length = YOLO_BATCH_SIZE * interval
+            pending = deque()
+            for chunk_start in range(0, len(frames), chunk_length):
                 if not self.keep_processing:
                     break
-                detections = None
-                for i, roi_im in enumerate(self.mask.apply_ROIs(im)):
-                    roi_im = self.warp.apply(roi_im, i)
-                    timestamp = frame_date.strftime("%Y_%m_%d_%H_%M_%S_%f")[:-3]
-                    frame_name = (
-                        self.prefix + f"_ts_{timestamp}_roi_{i:02d}_f_{frame_no}"
+                chunk = frames[chunk_start : chunk_start + chunk_length]
+                pending.append(
+                    (chunk, time(), self._submit_batch(chunk[::interval], input_size))
+                )
+                # keep every detection worker busy while the oldest chunk is
+                # tracked, without workers each chunk is tracked right away
+                if len(pending) > YOLO_WORKERS:
+                    timestamp = self._process_chunk(
+                        *pending.popleft(), interval, sum(frame_skip), input_size
                     )
-                    metadata_name = frame_name + ".json"
+            while pending:
+                timestamp = self._process_chunk(
+                    *pending.popleft(), interval, sum(frame_skip), input_size
+                )
 
-                    if ENCRYPT:
-                        frame_name += ".aes"
-                        encrypt_image(
-                            os.path.join(self.output_path, frame_name), roi_im
-                        )
-                        if DEBUG:
-                            cv2.imwrite(
-                                os.path.join(self.output_path, frame_name + ".jpg"),
-                                roi_im,
-                            )
-                    else:
-                        frame_name += ".jpg"
-                        cv2.imwrite(
-                            os.path.join(self.output_path, frame_name),
-                            roi_im,
-                            [int(cv2.IMWRITE_JPEG_QUALITY), 97],
-                        )
+            logging.info(
+                "YOLO block analysis time. {}s {}FPS, blocks {}, last ts {}".format(
+                    int(time() - started),
+                    round(frames_count / (time() - started), 2),
+                    len(self.image_cache),
+                    timestamp,
+                )
+            )
 
-                    if not detections:
-                        start_yolo = time()
-                        all_detections = self.yolo.detect(im)
-                        end_yolo = time()
-                        detections = [
-                            d
-                            for d in all_detections
-                            if d["label"] in VALID_VEHICLE_CLASSES
-                        ]
-
-                        bboxes = np.array([det["bbox"] for det in detections])
-                        confidences = np.array(
-                            [det["confidence"] for det in detections]
-                        )
+    def _process_chunk(self, chunk, started, batch, interval, skip_rate, input_size):
+        """Track and save frames of a chunk in order, once object detection of
+        the chunk has finished
 
-                        start_tracker = time()
-                        tracks = None
-                        if bboxes.shape[0] == 0 or confidences.shape[0] == 0:
-                            tracks = self.tracker.update()
-                        else:
-                            tracks = self.tracker.update(np.c_[bboxes, confidences])
+        Args:
+            chunk (List): processor.frame.Frame objects
+            started (float): Time object detection of the chunk was started
+            batch (int or List): Return value of _submit_batch
+            interval (int): Object detection is run on every Nth frame
+            skip_rate (int): Percentage of skipped frames, for logging
+            input_size (int): Input size of object detection
 
-                    roi_detections, roi_iods = self.mask.get_roi_detections(
-                        detections, i
-                    )
+        Returns:
+            str: Timestamp of the last frame used in file names
+        """
+        chunk_detections = self._batch_result(batch)
+        yolo_time = (time() - started) / len(chunk_detections)
+        for j, frame in enumerate(chunk):
+            if j % interval == 0:
+                timestamp = self._process_frame(
+                    frame,
+                    chunk_detections[j // interval],
+                    yolo_time,
+                    skip_rate,
+                    input_size,
+                )
+            else:
+                timestamp = self._process_frame(frame, None, 0.0, skip_rate, None)
+        return timestamp
 
-                    track_ids = []
-                    if roi_detections:
-                        track_ids = self._track_ids_for_detections(
-                            im, roi_detections, tracks
-                        )
-                    end_tracker = time()
-                    roi_metadata = {}
-                    roi_metadata["detections"] = roi_detections
-                    roi_metadata["iods"] = roi_iods
-                    roi_metadata["track_ids"] = track_ids
-                    roi_metadata["roi_offset"] = self.mask.get_roi_offset(i)
-                    roi_metadata["roi_dims"] = [roi_im.shape[1], roi_im.shape[0]]
-
-                    with open(
-                        os.path.join(self.output_path, metadata_name),
-                        "w",
-                        encoding="utf-8",
-                    ) as f:
-                        json.dump(roi_metadata, f, ensure_ascii=False)
-                    logging.info(
-                        "TIMERS: YOLO: {}s, tracker: {}s,  skipper: {}%, cache: {}, tracks: {}".format(
-                            round(end_yolo - start_yolo, 2),
-                            round(end_tracker - start_tracker, 2),
-                            sum(frame_skip),
-                            len(self.image_cache),
-                            str(track_ids),
-                        )
-                    )
+    def _process_frame(self, frame, all_detections, yolo_time, skip_rate, input_size):
+        """Update tracker with vehicle detections of a frame, and save ROI images
+        and their metadata. Frames without object detection get the boxes
+        predicted by the tracker, marked with a predicted flag.
+
+        Args:
+            frame (processor.frame.Frame): Processed frame
+            all_detections (numpy.ndarray or None): DETECTION_DTYPE records of
+                vehicle detections, None if object detection was not run
+            yolo_time (float): Object detection time of the frame in seconds
+            skip_rate (int): Percentage of skipped frames, for logging
+            input_size (int or None): Input size of object detection
 
+        Returns:
+            str: Timestamp of the frame used in file names
+        """
+        start_tracker = time()
+        dt = self._frame_delta(frame)
+        if all_detections is None:
+            tracks = self.tracker.predict(dt)
+            detections = self._predicted_detections(tracks)
+        else:
+            # non-maximum suppression keeps only vehicle classes
+            detections = all_detections
+            # the tracker tells which track each detection belongs to
+            _, detections["track_id"] = self.tracker.assign(
+                np.c_[detections["bbox"], detections["confidence"]], dt
+            )
+            if DETECTION_INTERVAL_MAX > 1:
+                self._update_track_labels(detections)
+
+        if self.started is not None:
+            # the first block waits for motion, which depends on the scene
             logging.info(
-                "YOLO block analysis time. {}s {}FPS, blocks {}, last ts {}".format(
-                    int(time() - started),
-                    round(frames_count / (time() - started), 2),
+                "Startup time to first processed frame: {}s, from first block: {}s".format(
+                    round(time() - self.started, 2),
+                    round(time() - self.first_block_started, 2),
+                )
+            )
+            self.started = None
+
+        timestamp = frame.frame_date.strftime("%Y_%m_%d_%H_%M_%S_%f")[:-3]
+        for i in range(len(frame.rois)):
+            iods = self.mask.get_roi_iods(detections["bbox"], i)
+            in_roi = iods > 0
+            roi_detections = detections[in_roi]
+            if not self._roi_output(frame, i, roi_detections):
+                continue
+
+            # suppressed ROIs are never warped
+            roi_im = frame.roi(i)
+            frame_name = self.prefix + f"_ts_{timestamp}_roi_{i:02d}_f_{frame.frame_no}"
+            metadata_name = frame_name + ".json"
+            frame_name += ".aes" if ENCRYPT else ".jpg"
+            track_ids = roi_detections["track_id"].tolist()
+            end_tracker = time()
+
+            # detections are converted to dictionaries only for serialization
+            roi_dicts = self.yolo.detections_to_dicts(roi_detections)
+            if all_detections is None:
+                for d in roi_dicts:
+                    d["predicted"] = True
+            roi_metadata = {}
+            roi_metadata["detections"] = roi_dicts
+            roi_metadata["iods"] = iods[in_roi].tolist()
+            roi_metadata["track_ids"] = track_ids
+            roi_metadata["roi_offset"] = self.mask.get_roi_offset(i)
+            roi_metadata["roi_dims"] = [roi_im.shape[1], roi_im.shape[0]]
+            roi_metadata["input_size"] = input_size
+
+            # encoding and writing wait only if the writer queue is full
+            self.writer.put(
+                os.path.join(self.output_path, frame_name),
+                roi_im,
+                os.path.join(self.output_path, metadata_name),
+                roi_metadata,
+            )
+            logging.info(
+                "TIMERS: YOLO: {}s, tracker: {}s,  skipper: {}%, cache: {}, tracks: {}".format(
+                    round(yolo_time, 2),
+                    round(end_tracker - start_tracker, 2),
+                    skip_rate,
                     len(self.image_cache),
-                    timestamp,
+                    str(track_ids),
                 )
             )
 
-    def _track_ids_for_detections(self, im, detections, tracks):
-        """This function maps bounding boxes received from SORT tracking back to
-        original object detections. Matches are determined using a suitable distance threshold.
+        return timestamp
+
+    def _roi_output(self, frame, roi_id, roi_detections):
+        """Decide if a ROI image is written, and count written and suppressed
+        ROI images. With ROI_OUTPUT "detections" a ROI is written only if it
+        contains a vehicle, detected or predicted by the tracker. With "motion"
+        the ROI must also have had motion when the block of the frame started.
 
         Args:
-            im (numpy.ndarray): Input image whose dimensions are used to determine suitable threshold
-            detections (List): List of dictionaries containing object detection data
-            tracks (numpy.ndarray): Bounding boxes and tracking identifiers from SORT algorithm
+            frame (processor.frame.Frame): Processed frame
+            roi_id (int): Identifier of processed region in image
+            roi_detections (numpy.ndarray): DETECTION_DTYPE records in the ROI
 
         Returns:
-            List: Tracking identifiers matching object detections
+            bool: True if the ROI image is written
         """
-        track_ids = [-1] * len(detections)
-        bboxes = np.array([det["bbox"] for det in detections])
+        if self.roi_output != "all" and len(roi_detections) == 0:
+            self.roi_output_counts["no_detection"] += 1
+            return False
+        if (
+            self.roi_output == "motion"
+            and frame.roi_motion is not None
+            and not frame.roi_motion[roi_id]
+        ):
+            self.roi_output_counts["no_motion"] += 1
+            return False
+        self.roi_output_counts["written"] += 1
+        return True
+
+    def _frame_delta(self, frame):
+        """Count frames elapsed since the last tracked frame, including frames
+        skipped under load, so the tracker predicts motion over the real time
 
-        # SORT does not return an index for detection so set threshold based on image size
-        sort_match_limit = np.square((im.shape[0] + im.shape[1]) * 0.5 * 0.02)
+        Args:
+            frame (processor.frame.Frame): Tracked frame
 
-        for i in range(tracks.shape[0]):
-            ss = np.sum(np.square(bboxes - tracks[i, :4]), axis=1)
-            min_row = np.argmin(ss, axis=0)
+        Returns:
+            int: Number of frames, 1 for the first frame or if numbering restarted
+        """
+        dt = 1
+        if self.tracked_frame_no is not None and frame.frame_no > self.tracked_frame_no:
+            dt = frame.frame_no - self.tracked_frame_no
+        self.tracked_frame_no = frame.frame_no
+        return dt
 
-            if ss[min_row] < sort_match_limit:
-                track_ids[min_row] = int(tracks[i, 4])
-            else:
-                track_ids[min_row] = -1
+    def _update_track_labels(self, detections):
+        """Remember label and confidence of the latest detection of each track,
+        for the boxes predicted between detected frames
+
+        Args:
+            detections (numpy.ndarray): DETECTION_DTYPE records of the frame
+        """
+        for d in detections[detections["track_id"] >= 0]:
+            self.track_labels[int(d["track_id"])] = (d["confidence"], d["class_id"])
+
+        alive = set((self.tracker.ids + 1).tolist())
+        for track_id in list(self.track_labels):
+            if track_id not in alive:
+                del self.track_labels[track_id]
 
-        return track_ids
+    def _predicted_detections(self, tracks):
+        """Create detections from boxes predicted by the tracker
+
+        Args:
+            tracks (numpy.ndarray): Predicted bounding boxes and tracking identifiers
+
+        Returns:
+            numpy.ndarray: DETECTION_DTYPE records with confidence and class index
+                  of the last detection of the track
+        """
+        track_ids = [int(track_id) for track_id in tracks[:, 4]]
+        known = np.array([i in self.track_labels for i in track_ids], dtype=bool)
+        labels = [self.track_labels[i] for i in track_ids if i in self.track_labels]
+
+        detections = np.empty(int(known.sum()), dtype=DETECTION_DTYPE)
+        detections["bbox"] = np.round(tracks[known, :4])
+        detections["confidence"] = [confidence for confidence, _ in labels]
+        detections["class_id"] = [class_id for _, class_id in labels]
+        detections["track_id"] = tracks[known, 4]
+        return detections
 
     def _discard_n(self, n, length=30):
         """from 30 FPS hypothesis, discard N frames.
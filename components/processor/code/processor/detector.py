@@ -65,7 +65,7 @@ def process_videos_to_images(video_path, mask_path, warp_path, output_path, thre
                     cv2.CAP_PROP_POS_FRAMES
                 ) == cap.get(cv2.CAP_PROP_FRAME_COUNT):
                     processor.stop()
-                    sleep(1)
+                    processor.release()
                     break
 
             cap.release()
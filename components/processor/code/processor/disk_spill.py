@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+
+import glob
+import json
+import logging
+import os
+import struct
+import numpy as np
+
+from collections import deque
+from datetime import datetime
+from threading import Lock
+
+
+MAGIC = b"RMPBLK01"
+ALIGNMENT = 64
+
+
+class DiskSpill:
+    def __init__(self, path, max_bytes, frame_loader):
+        """Overflow storage for frame blocks which do not fit in memory. Each
+        block is written to its own file, containing a small JSON header and
+        the raw image data of the frames. Blocks are read back in the order
+        they were written, as memory-mapped arrays.
+
+        Args:
+            path (str): Folder for block files. Old block files are removed.
+            max_bytes (int): Maximum disk space used by block files in bytes
+            frame_loader (Callable): Function creating a frame from frame date,
+                frame number and dictionary of image arrays
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.frame_loader = frame_loader
+        self.lock = Lock()
+        self.files = deque()
+        self.nbytes = 0
+        self.seconds = 0.0
+        self.counter = 0
+
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        for filename in glob.glob(os.path.join(self.path, "block_*.bin")):
+            os.remove(filename)
+
+    def __len__(self):
+        return len(self.files)
+
+    def write(self, block, seconds=0.0):
+        """Write a block to disk, if it fits in the disk budget
+
+        Args:
+            block (List): List of processor.frame.Frame objects
+            seconds (float, optional): Duration of the block. Defaults to 0.0.
+
+        Returns:
+            bool: True if the block was written
+        """
+        frames = []
+        arrays = []
+        offset = 0
+        for frame in block:
+            entries = []
+            for name, array in frame.to_arrays().items():
+                array = np.ascontiguousarray(array)
+                entries.append(
+                    {
+                        "name": name,
+                        "dtype": array.dtype.str,
+                        "shape": list(array.shape),
+                        "offset": offset,
+                    }
+                )
+                arrays.append((offset, array))
+                offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+            try:
+                frame_date = frame.frame_date.timestamp()
+            except AttributeError:
+                frame_date = None
+            frames.append(
+                {
+                    "frame_no": frame.frame_no,
+                    "frame_date": frame_date,
+                    "arrays": entries,
+                }
+            )
+
+        header = json.dumps({"frames": frames}).encode("utf-8")
+        data_start = -(-(len(MAGIC) + 8 + len(header)) // ALIGNMENT) * ALIGNMENT
+        nbytes = data_start + offset
+        if self.nbytes + nbytes > self.max_bytes:
+            return False
+
+        filename = os.path.join(self.path, f"block_{self.counter:08d}.bin")
+        self.counter += 1
+        try:
+            with open(filename, "wb") as f:
+                f.write(MAGIC + struct.pack("<Q", len(header)) + header)
+                for array_offset, array in arrays:
+                    f.seek(data_start + array_offset)
+                    f.write(array.data)
+                f.truncate(nbytes)
+        except OSError as e:
+            logging.error(f"Could not write block file {filename}: {str(e)}")
+            if os.path.exists(filename):
+                os.remove(filename)
+            return False
+
+        with self.lock:
+            self.files.append((filename, nbytes, seconds))
+            self.nbytes += nbytes
+            self.seconds += seconds
+        return True
+
+    def read(self):
+        """Read and remove the oldest block from disk. Image data stays memory
+        mapped until the frames are released.
+
+        Returns:
+            List or None: List of processor.frame.Frame objects, None if empty
+        """
+        return self.load(self.pop())
+
+    def pop(self):
+        """Remove the oldest block from the spill without reading it
+
+        Returns:
+            str or None: Filename of the block to be read with load, None if empty
+        """
+        with self.lock:
+            if not self.files:
+                return None
+            filename, nbytes, seconds = self.files.popleft()
+            self.nbytes -= nbytes
+            self.seconds -= seconds
+        return filename
+
+    def load(self, filename):
+        """Read a block removed with pop and delete its file
+
+        Args:
+            filename (str or None): Filename returned by pop
+
+        Returns:
+            List or None: List of processor.frame.Frame objects, None if the
+                          block could not be read
+        """
+        if filename is None:
+            return None
+        try:
+            with open(filename, "rb") as f:
+                if f.read(len(MAGIC)) != MAGIC:
+                    raise ValueError("unknown file format")
+                (header_length,) = struct.unpack("<Q", f.read(8))
+                header = json.loads(f.read(header_length).decode("utf-8"))
+            data_start = -(-(len(MAGIC) + 8 + header_length) // ALIGNMENT) * ALIGNMENT
+            # copy-on-write mapping, frames can be modified without touching the file
+            data = np.memmap(filename, dtype=np.uint8, mode="c")
+        except (OSError, ValueError) as e:
+            logging.error(f"Could not read block file {filename}: {str(e)}")
+            return None
+        finally:
+            # mapped data stays available after the file is removed
+            if os.path.exists(filename):
+                os.remove(filename)
+
+        block = []
+        for frame in header["frames"]:
+            arrays = {
+                entry["name"]: np.ndarray(
+                    entry["shape"],
+                    dtype=np.dtype(entry["dtype"]),
+                    buffer=data,
+                    offset=data_start + entry["offset"],
+                )
+                for entry in frame["arrays"]
+            }
+            frame_date = frame["frame_date"]
+            if frame_date is not None:
+                frame_date = datetime.fromtimestamp(frame_date)
+            block.append(self.frame_loader(frame_date, frame["frame_no"], arrays))
+
+        return block
+
+    def clear(self):
+        """Remove all block files"""
+        with self.lock:
+            while self.files:
+                filename, _, _ = self.files.popleft()
+                if os.path.exists(filename):
+                    os.remove(filename)
+            self.nbytes = 0
+            self.seconds = 0.0
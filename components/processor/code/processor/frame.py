@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+
+class Frame:
+    def __init__(self, frame_date, frame_no, im, mask, warp):
+        """Captured frame which is passed from motion detection to object detection.
+        ROI images are masked and warped on first access and cached, so each ROI
+        of a frame is rectified only once in the whole pipeline.
+
+        Args:
+            frame_date (datetime.datetime): Capture time of the frame
+            frame_no (int): Running number of the frame
+            im (numpy.ndarray): Captured image
+            mask (processor.mask.Mask): Mask defining the ROIs
+            warp (processor.warp.Warp): Warps rectifying the ROIs
+        """
+        self.frame_date = frame_date
+        self.frame_no = frame_no
+        self.im = im
+        self.im_shape = im.shape if im is not None else None
+        self.detector_im = None
+        self.mask = mask
+        self.warp = warp
+        self.rois = [None] * mask.ROI_count()
+        # ROIs with motion at the start of the block, None if not known
+        self.roi_motion = None
+
+    @property
+    def nbytes(self):
+        """Memory used by the frame and its cached ROI images in bytes"""
+        arrays = [self.im, self.detector_im] + self.rois
+        return sum(array.nbytes for array in arrays if array is not None)
+
+    def roi(self, roi_id):
+        """Retrieve masked and warped image of given ROI
+
+        Args:
+            roi_id (int): Identifier of processed region in image
+
+        Returns:
+            numpy.ndarray: Rectified ROI image
+        """
+        if self.rois[roi_id] is None:
+            self.rois[roi_id] = self.warp.apply(
+                self.mask.apply_ROI(self.im, roi_id), roi_id
+            )
+
+        return self.rois[roi_id]
+
+    def compact(self, letterbox):
+        """Keep only the ROI images and the input image of object detection,
+        and release the captured image.
+
+        Args:
+            letterbox (Callable): Function creating the object detection input
+        """
+        if self.im is None:
+            return
+
+        self.roi_images()
+        self.detector_im = letterbox(self.im)
+        self.im = None
+
+    def to_arrays(self):
+        """Retrieve image data of the frame for serialization
+
+        Returns:
+            dict: Captured image, detector input, cached ROI images and ROI
+                  motion by name
+        """
+        arrays = {"im_shape": np.array(self.im_shape)}
+        if self.roi_motion is not None:
+            arrays["roi_motion"] = self.roi_motion
+        if self.im is not None:
+            arrays["im"] = self.im
+        if self.detector_im is not None:
+            arrays["detector_im"] = self.detector_im
+        for i, roi_im in enumerate(self.rois):
+            if roi_im is not None:
+                arrays[f"roi_{i:02d}"] = roi_im
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, frame_date, frame_no, arrays, mask, warp):
+        """Create a frame from serialized image data
+
+        Args:
+            frame_date (datetime.datetime): Capture time of the frame
+            frame_no (int): Running number of the frame
+            arrays (dict): Image data returned by to_arrays
+            mask (processor.mask.Mask): Mask defining the ROIs
+            warp (processor.warp.Warp): Warps rectifying the ROIs
+
+        Returns:
+            Frame: Restored frame
+        """
+        frame = cls(frame_date, frame_no, arrays.get("im"), mask, warp)
+        frame.im_shape = tuple(arrays["im_shape"].tolist())
+        frame.detector_im = arrays.get("detector_im")
+        frame.roi_motion = arrays.get("roi_motion")
+        for i in range(len(frame.rois)):
+            frame.rois[i] = arrays.get(f"roi_{i:02d}")
+        return frame
+
+    def roi_images(self):
+        """Retrieve masked and warped images of all ROIs
+
+        Returns:
+            List: Rectified ROI images
+        """
+        return [self.roi(i) for i in range(len(self.rois))]
@@ -55,7 +55,17 @@ class Mask:
                 np.min(roi_pixels[:, 1]),
                 np.max(roi_pixels[:, 1]),
             ]
-            roi_mask = np.dstack((roi_mask, roi_mask, roi_mask))
+            roi_slice = (
+                slice(extent[0], extent[1]),
+                slice(extent[2], extent[3]),
+            )
+            roi_mask_crop = np.ascontiguousarray(roi_mask[roi_slice])
+            # summed-area table over the inclusive extent for O(1) IOD lookups
+            roi_integral = cv2.integral(
+                (
+                    roi_mask[extent[0] : extent[1] + 1, extent[2] : extent[3] + 1] > 0
+                ).astype(np.uint8)
+            )
 
             roi = {}
             roi["center_pixel"] = (
@@ -65,26 +75,46 @@ class Mask:
             ) / 2  # id as bounding center
             roi["mask"] = roi_mask
             roi["extent"] = extent
+            roi["slice"] = roi_slice
+            roi["crop_mask"] = roi_mask_crop
+            # rectangular ROIs need no masking, slicing is enough
+            roi["is_rect"] = bool(np.all(roi_mask_crop == color))
+            roi["integral"] = roi_integral
 
             self.ROIs.append(roi)
 
         sorted(self.ROIs, key=lambda roi: roi["center_pixel"])
 
     def apply_ROIs(self, im_to_be_masked):
-        """Apply masks and generate a ROI images from image given as argument
+        """Apply masks and generate a ROI images from image given as argument.
+        Only the pixels inside each ROI extent are touched. Rectangular ROIs
+        are returned as views into the input image without masking.
 
         Args:
             im_to_be_masked (numpy.ndarray): Input image to be masked
 
         Yields:
-            numpy.ndarray: [description]
+            numpy.ndarray: Masked ROI image cropped to the ROI extent
+        """
+        for i in range(len(self.ROIs)):
+            yield self.apply_ROI(im_to_be_masked, i)
+
+    def apply_ROI(self, im_to_be_masked, roi_id):
+        """Apply mask of a single ROI and crop the image to the ROI extent
+
+        Args:
+            im_to_be_masked (numpy.ndarray): Input image to be masked
+            roi_id (int): Identifier of processed region in image
+
+        Returns:
+            numpy.ndarray: Masked ROI image cropped to the ROI extent
         """
-        for roi in self.ROIs:
-            extent = roi["extent"]
-            im_masked_full = cv2.bitwise_and(im_to_be_masked, roi["mask"])
-            im_masked_roi = im_masked_full[extent[0] : extent[1], extent[2] : extent[3]]
+        roi = self.ROIs[roi_id]
+        im_roi = im_to_be_masked[roi["slice"]]
+        if roi["is_rect"]:
+            return im_roi
 
-            yield im_masked_roi
+        return cv2.bitwise_and(im_roi, im_roi, mask=roi["crop_mask"])
 
     def get_roi_detections(self, global_detections, roi_id):
         """Retrieve object detections which intersect with the given ROI.
@@ -105,30 +135,95 @@ class Mask:
         roi_iods = []
 
         if global_detections:
-            color = 255
-            im_mask_bin = roi["mask"][:, :, 0]
-
-            for d in global_detections:
-                p1 = (int(d["bbox"][0] + 0.5), int(d["bbox"][1] + 0.5))
-                p2 = (int(d["bbox"][2] + 0.5), int(d["bbox"][3] + 0.5))
-
-                det_mask_bin = np.zeros_like(im_mask_bin)
-                cv2.rectangle(det_mask_bin, p1, p2, color, -1)
-
-                area_det = np.count_nonzero(det_mask_bin)
-
-                roi_det_intersection = cv2.bitwise_and(det_mask_bin, im_mask_bin)
-                area_intersection = np.count_nonzero(roi_det_intersection)
+            bboxes = np.array([d["bbox"] for d in global_detections])
+            iods = self.get_roi_iods(bboxes, roi_id).tolist()
 
-                iod = 0  # "intersection over detection"
-                if area_det > 0:
-                    iod = area_intersection / area_det
+            for d, iod in zip(global_detections, iods):
                 if iod > 0:
                     roi_detections.append(d)
                     roi_iods.append(iod)
 
         return roi_detections, roi_iods
 
+    def get_roi_iods(self, bboxes, roi_id):
+        """Calculate intersection over detection (IOD) of bounding boxes with
+        the given ROI. Bounding boxes are rounded to pixels and clipped to the
+        image like a filled rectangle drawn on the mask, and the intersecting
+        area is looked up from the ROI's summed-area table.
+
+        Args:
+            bboxes (numpy.ndarray): Bounding boxes as rows of [x1, y1, x2, y2]
+            roi_id (int): Identifier of processed region in image
+
+        Returns:
+            numpy.ndarray: IOD for each bounding box
+        """
+        bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+        if roi_id >= len(self.ROIs) or bboxes.shape[0] == 0:
+            return np.zeros(bboxes.shape[0])
+
+        roi = self.ROIs[roi_id]
+        extent = roi["extent"]
+        integral = roi["integral"]
+        height, width = self.im.shape[:2]
+
+        corners = np.trunc(bboxes + 0.5).astype(np.int64)
+        x1 = np.minimum(corners[:, 0], corners[:, 2])
+        x2 = np.maximum(corners[:, 0], corners[:, 2])
+        y1 = np.minimum(corners[:, 1], corners[:, 3])
+        y2 = np.maximum(corners[:, 1], corners[:, 3])
+        inside = (x2 >= 0) & (x1 < width) & (y2 >= 0) & (y1 < height)
+
+        x1 = np.clip(x1, 0, width - 1)
+        x2 = np.clip(x2, 0, width - 1)
+        y1 = np.clip(y1, 0, height - 1)
+        y2 = np.clip(y2, 0, height - 1)
+        area_det = (x2 - x1 + 1) * (y2 - y1 + 1) * inside
+
+        # integral image coordinates, end points exclusive
+        rows, cols = integral.shape[0] - 1, integral.shape[1] - 1
+        ix1 = np.clip(x1 - extent[2], 0, cols)
+        ix2 = np.clip(x2 - extent[2] + 1, 0, cols)
+        iy1 = np.clip(y1 - extent[0], 0, rows)
+        iy2 = np.clip(y2 - extent[0] + 1, 0, rows)
+        area_intersection = (
+            integral[iy2, ix2]
+            - integral[iy1, ix2]
+            - integral[iy2, ix1]
+            + integral[iy1, ix1]
+        ) * inside
+
+        iods = np.zeros(bboxes.shape[0])
+        np.divide(area_intersection, area_det, out=iods, where=area_det > 0)
+        return iods
+
+    def get_detection_slice(self, padding=0):
+        """Retrieve the part of the image where object detections can intersect
+        a ROI: the union of ROI extents grown by padding and clipped to the image
+
+        Args:
+            padding (int, optional): Pixels added on each side. Defaults to 0.
+
+        Returns:
+            Tuple(slice, slice): Rows and columns of the region, the whole
+                image if there are no ROIs
+        """
+        height, width = self.im.shape[:2]
+        if not self.ROIs:
+            return (slice(0, height), slice(0, width))
+
+        extents = np.array([roi["extent"] for roi in self.ROIs])
+        return (
+            slice(
+                int(max(extents[:, 0].min() - padding, 0)),
+                int(min(extents[:, 1].max() + 1 + padding, height)),
+            ),
+            slice(
+                int(max(extents[:, 2].min() - padding, 0)),
+                int(min(extents[:, 3].max() + 1 + padding, width)),
+            ),
+        )
+
     def get_roi_offset(self, roi_id):
         """Retrieve pixel offset of given ROI's top-left corner
 
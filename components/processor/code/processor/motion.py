@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+
+import cv2
+import logging
+import numpy as np
+
+from abc import ABC, abstractmethod
+
+
+class MotionDetector(ABC):
+    def __init__(
+        self, mask, threshold, scale=4, adaptive=False, window=300, sensitivity=3.0
+    ):
+        """Base class for detecting motion in ROIs. Backends calculate a motion
+        score for every ROI of a frame, and motion is detected when any score
+        exceeds the threshold of the ROI. Scores are calculated from a downscaled
+        grayscale copy of the frame.
+
+        With adaptive thresholds, the noise floor of each ROI is learned from
+        the scores of recently checked frames. Frames inside motion blocks are
+        not checked, so the scores are dominated by frames without vehicles.
+        The threshold of a ROI is raised to median + sensitivity * deviation of
+        its recent scores, but never below the given threshold.
+
+        Args:
+            mask (processor.mask.Mask): Mask defining the ROIs
+            threshold (int): Motion score threshold
+            scale (int, optional): Downscaling factor of the frame. Defaults to 4.
+            adaptive (bool, optional): Adapt ROI thresholds to noise. Defaults to False.
+            window (int, optional): Number of recent scores to learn from. Defaults to 300.
+            sensitivity (float, optional): Allowed deviations above noise. Defaults to 3.0.
+        """
+        self.threshold = threshold
+        self.scale = scale
+        self.adaptive = adaptive
+        self.window = window
+        self.sensitivity = sensitivity
+        self.roi_slices = []
+        self.roi_masks = []
+        self.roi_areas = []
+
+        roi_count = mask.ROI_count()
+        self.thresholds = np.full(roi_count, float(threshold))
+        self.history = np.zeros((roi_count, window))
+        self.checked = 0
+        self.triggered = 0
+        self.roi_triggers = np.zeros(roi_count, dtype=int)
+        # ROIs with motion in the last checked frame
+        self.roi_motion = np.zeros(roi_count, dtype=bool)
+
+        if mask.ROI_count() == 0:
+            return
+
+        height, width = mask.im.shape[:2]
+        self.size = (max(1, width // scale), max(1, height // scale))
+        for roi in mask.ROIs:
+            extent = roi["extent"]
+            top, left = extent[0] // scale, extent[2] // scale
+            roi_slice = (
+                slice(top, max(extent[1] // scale, top + 1)),
+                slice(left, max(extent[3] // scale, left + 1)),
+            )
+            small_mask = cv2.resize(
+                roi["mask"], self.size, interpolation=cv2.INTER_NEAREST
+            )[roi_slice]
+            self.roi_slices.append(roi_slice)
+            self.roi_masks.append(small_mask > 0)
+            self.roi_areas.append(max(1, np.count_nonzero(small_mask)))
+
+    def _gray(self, frame):
+        """Downscale and convert frame to grayscale
+
+        Args:
+            frame (processor.frame.Frame): Captured frame
+
+        Returns:
+            numpy.ndarray: Downscaled grayscale image
+        """
+        im = cv2.resize(frame.im, self.size, interpolation=cv2.INTER_AREA)
+        if np.ndim(im) > 2:
+            im = cv2.cvtColor(im, cv2.COLOR_BGR2GRAY)
+        return im
+
+    def _changed_percentage(self, changed):
+        """Calculate percentage of changed pixels in every ROI
+
+        Args:
+            changed (numpy.ndarray): Boolean image of changed pixels
+
+        Returns:
+            numpy.ndarray: Percentage of changed pixels for each ROI
+        """
+        return np.array(
+            [
+                100.0 * np.count_nonzero(changed[roi_slice] & roi_mask) / area
+                for roi_slice, roi_mask, area in zip(
+                    self.roi_slices, self.roi_masks, self.roi_areas
+                )
+            ]
+        )
+
+    @abstractmethod
+    def scores(self, frame):
+        """Calculate motion scores of a frame, and update the reference if the
+        backend follows every checked frame.
+
+        Args:
+            frame (processor.frame.Frame): Captured frame
+
+        Returns:
+            numpy.ndarray: Motion score for each ROI
+        """
+
+    def update(self, frame):
+        """Set the reference for motion detection, called with the last frame
+        of a block after motion has ended. Backends without a reference do
+        nothing.
+
+        Args:
+            frame (processor.frame.Frame): Captured frame
+        """
+
+    def detect(self, frame):
+        """Check if there is motion in any ROI of the frame
+
+        Args:
+            frame (processor.frame.Frame): Captured frame
+
+        Returns:
+            bool: True if motion score of any ROI exceeds the threshold, the
+                  ROIs with motion are left in roi_motion
+        """
+        if not self.roi_slices:
+            return False
+
+        scores = self.scores(frame)
+        motion = scores > self.thresholds
+        self.roi_motion = motion
+        self.checked += 1
+        if np.any(motion):
+            self.triggered += 1
+            self.roi_triggers += motion
+        if self.adaptive:
+            self._learn(scores)
+
+        return bool(np.any(motion))
+
+    def _learn(self, scores):
+        """Update ROI thresholds from the scores of recently checked frames
+
+        Args:
+            scores (numpy.ndarray): Motion score for each ROI
+        """
+        self.history[:, (self.checked - 1) % self.window] = scores
+        if self.checked < self.window // 10:
+            # not enough samples to estimate noise yet
+            return
+
+        recent = self.history[:, : min(self.checked, self.window)]
+        median = np.median(recent, axis=1)
+        # median absolute deviation, scaled to match standard deviation
+        deviation = 1.4826 * np.median(np.abs(recent - median[:, None]), axis=1)
+        self.thresholds = np.maximum(
+            self.threshold, median + self.sensitivity * deviation
+        )
+
+    def statistics(self):
+        """Retrieve motion detection statistics
+
+        Returns:
+            dict: Checked and triggered frame counts, triggers and thresholds per ROI
+        """
+        return {
+            "checked": self.checked,
+            "triggered": self.triggered,
+            "roi_triggers": self.roi_triggers.tolist(),
+            "thresholds": np.round(self.thresholds, 1).tolist(),
+        }
+
+
+class PHashMotionDetector(MotionDetector):
+    def __init__(self, mask, threshold, **kwargs):
+        """Motion detector comparing perceptual hashes of rectified ROI images
+        to the hashes of the last frame of previous block. Score is the Hamming
+        distance of the hashes.
+        """
+        super().__init__(mask, threshold, **kwargs)
+        import imagehash
+        from PIL import Image
+
+        self._phash = lambda im: imagehash.phash(Image.fromarray(im))
+        self.previous_roi_hash = [self._phash(np.zeros((10, 10)))] * mask.ROI_count()
+
+    def scores(self, frame):
+        return np.array(
+            [
+                previous_hash - self._phash(roi_im)
+                for previous_hash, roi_im in zip(
+                    self.previous_roi_hash, frame.roi_images()
+                )
+            ]
+        )
+
+    def update(self, frame):
+        self.previous_roi_hash = [self._phash(roi_im) for roi_im in frame.roi_images()]
+
+
+class DCTHashMotionDetector(MotionDetector):
+    def __init__(self, mask, threshold, hash_size=8, highfreq_factor=4, **kwargs):
+        """Motion detector computing perceptual hashes of all ROIs at once. ROIs
+        are resized to 32x32 pixels and the low frequency block of their 2D DCT
+        is compared to its median, like in imagehash.phash. Score is the Hamming
+        distance to the hashes of the last frame of previous block.
+        """
+        super().__init__(mask, threshold, **kwargs)
+        self.hash_size = hash_size
+        self.im_size = hash_size * highfreq_factor
+        n = np.arange(self.im_size)
+        k = np.arange(hash_size)
+        # rows of an unnormalized DCT-II matrix, only low frequencies are needed
+        self.dct = 2 * np.cos(
+            np.pi * k[:, None] * (2 * n[None, :] + 1) / (2 * self.im_size)
+        )
+        self.previous_hashes = np.zeros(
+            (len(self.roi_slices), hash_size * hash_size), dtype=bool
+        )
+
+    def _hashes(self, frame):
+        """Calculate DCT hashes of all ROIs of a frame
+
+        Args:
+            frame (processor.frame.Frame): Captured frame
+
+        Returns:
+            numpy.ndarray: Hash bits for each ROI
+        """
+        gray = self._gray(frame)
+        rois = np.empty((len(self.roi_slices), self.im_size, self.im_size))
+        for i, (roi_slice, roi_mask) in enumerate(zip(self.roi_slices, self.roi_masks)):
+            rois[i] = cv2.resize(
+                gray[roi_slice] * roi_mask,
+                (self.im_size, self.im_size),
+                interpolation=cv2.INTER_AREA,
+            )
+        lowfreq = (self.dct @ rois @ self.dct.T).reshape(len(self.roi_slices), -1)
+        return lowfreq > np.median(lowfreq, axis=1, keepdims=True)
+
+    def scores(self, frame):
+        return np.count_nonzero(self._hashes(frame) != self.previous_hashes, axis=1)
+
+    def update(self, frame):
+        self.previous_hashes = self._hashes(frame)
+
+
+class FrameDifferenceMotionDetector(MotionDetector):
+    def __init__(self, mask, threshold, pixel_threshold=25, **kwargs):
+        """Motion detector comparing each checked frame to the previous one.
+        Score is the percentage of ROI pixels whose intensity changed more than
+        the pixel threshold.
+        """
+        super().__init__(mask, threshold, **kwargs)
+        self.pixel_threshold = pixel_threshold
+        self.previous = None
+
+    def scores(self, frame):
+        gray = self._gray(frame)
+        previous, self.previous = self.previous, gray
+        if previous is None:
+            return np.zeros(len(self.roi_slices))
+
+        return self._changed_percentage(
+            cv2.absdiff(gray, previous) > self.pixel_threshold
+        )
+
+    def update(self, frame):
+        self.previous = self._gray(frame)
+
+
+class BackgroundMotionDetector(MotionDetector):
+    def __init__(self, mask, threshold, pixel_threshold=25, alpha=0.05, **kwargs):
+        """Motion detector comparing frames to a running average background.
+        Frames without motion are blended into the background. Score is the
+        percentage of ROI pixels differing from the background more than the
+        pixel threshold.
+        """
+        super().__init__(mask, threshold, **kwargs)
+        self.pixel_threshold = pixel_threshold
+        self.alpha = alpha
+        self.background = None
+
+    def scores(self, frame):
+        gray = self._gray(frame).astype(np.float32)
+        if self.background is None:
+            self.background = gray
+            return np.zeros(len(self.roi_slices))
+
+        changed = cv2.absdiff(gray, self.background) > self.pixel_threshold
+        scores = self._changed_percentage(changed)
+        if not np.any(scores > self.thresholds):
+            cv2.accumulateWeighted(gray, self.background, self.alpha)
+        return scores
+
+    def update(self, frame):
+        gray = self._gray(frame).astype(np.float32)
+        if self.background is None:
+            self.background = gray
+        else:
+            cv2.accumulateWeighted(gray, self.background, self.alpha)
+
+
+MOTION_DETECTORS = {
+    "phash": PHashMotionDetector,
+    "dct": DCTHashMotionDetector,
+    "diff": FrameDifferenceMotionDetector,
+    "background": BackgroundMotionDetector,
+}
+
+
+def get_motion_detector(name, mask, threshold, adaptive=False):
+    """Create a motion detector backend
+
+    Args:
+        name (str): Name of the backend: phash, dct, diff or background
+        mask (processor.mask.Mask): Mask defining the ROIs
+        threshold (int): Motion score threshold
+        adaptive (bool, optional): Adapt ROI thresholds to noise. Defaults to False.
+
+    Returns:
+        MotionDetector: Motion detector backend
+    """
+    if name not in MOTION_DETECTORS:
+        logging.error(f"Unknown motion detector {name}, using phash")
+        name = "phash"
+    logging.info(f"Motion detector: {name}")
+    return MOTION_DETECTORS[name](mask, threshold, adaptive=adaptive)
@@ -6,16 +6,33 @@ import logging
 import numpy as np
 
 
+INTERPOLATIONS = {
+    "nearest": cv2.INTER_NEAREST,
+    "linear": cv2.INTER_LINEAR,
+    "cubic": cv2.INTER_CUBIC,
+}
+
+
 class Warp:
-    def __init__(self, warp_filename):
+    def __init__(self, warp_filename, interpolation="cubic"):
         """Warp is an utility class to rectify images containing
         license plates with perspective distortion.
 
+        Homographies are solved once when the warp file is loaded. Remap tables
+        are built on first use for each ROI and image size, after which warping
+        an image is a single lookup table pass.
+
         Args:
             warp_filename (str): Filename of warp file in JSON format
+            interpolation (str, optional): Interpolation method, one of "nearest",
+                "linear" or "cubic". Defaults to "cubic".
         """
         logging.basicConfig(level=logging.INFO)
 
+        self.interpolation = INTERPOLATIONS.get(interpolation, cv2.INTER_CUBIC)
+        self.homographies = {}
+        self.maps = {}
+
         try:
             with open(warp_filename, "r", encoding="utf-8") as f:
                 self.warps = json.load(f)
@@ -27,6 +44,57 @@ class Warp:
                 f"Could not find or parse warp json file {warp_filename}: " + str(e)
             )
 
+        if self.warps:
+            self._process()
+
+    def _process(self):
+        """Solve homographies for all ROIs defined in the warp file"""
+        for warp in self.warps["warps"]:
+            roi_id = warp["roi_id"]
+            if roi_id in self.homographies:
+                # first definition of the ROI is used
+                continue
+            if len(warp["src_points"]) > 3 and len(warp["dst_points"]) > 3:
+                try:
+                    h, _ = cv2.findHomography(
+                        np.array(warp["src_points"]), np.array(warp["dst_points"])
+                    )
+                    if h is not None:
+                        self.homographies[roi_id] = h
+                except Exception as e:
+                    logging.info("Failed to calculate homography: " + str(e))
+
+    def _get_maps(self, roi_id, size):
+        """Retrieve fixed-point remap tables for given ROI and image size.
+        Tables are calculated on first call and cached.
+
+        Args:
+            roi_id (int): Identifier of processed region in image
+            size (Tuple(int, int)): Image height and width
+
+        Returns:
+            Tuple(numpy.ndarray, numpy.ndarray): Map pair for cv2.remap
+        """
+        key = (roi_id, size)
+        if key not in self.maps:
+            height, width = size
+            h_inv = np.linalg.inv(self.homographies[roi_id])
+            xs, ys = np.meshgrid(
+                np.arange(width, dtype=np.float64), np.arange(height, dtype=np.float64)
+            )
+            w = h_inv[2, 0] * xs + h_inv[2, 1] * ys + h_inv[2, 2]
+            w = np.divide(1.0, w, out=np.zeros_like(w), where=w != 0)
+            map_x = (h_inv[0, 0] * xs + h_inv[0, 1] * ys + h_inv[0, 2]) * w
+            map_y = (h_inv[1, 0] * xs + h_inv[1, 1] * ys + h_inv[1, 2]) * w
+            self.maps[key] = cv2.convertMaps(
+                map_x.astype(np.float32),
+                map_y.astype(np.float32),
+                cv2.CV_16SC2,
+                nninterpolation=self.interpolation == cv2.INTER_NEAREST,
+            )
+
+        return self.maps[key]
+
     def apply(self, im, roi_id):
         """Apply warping to image
 
@@ -37,28 +105,10 @@ class Warp:
         Returns:
             numpy.ndarray: Warped image
         """
-        if not self.warps:
+        if roi_id not in self.homographies:
             return im.copy()
 
-        im_warp = None
-
-        warp = next(
-            filter(lambda roi: roi["roi_id"] == roi_id, self.warps["warps"]), None
+        map1, map2 = self._get_maps(roi_id, im.shape[:2])
+        return cv2.remap(
+            im, map1, map2, self.interpolation, borderMode=cv2.BORDER_CONSTANT
         )
-
-        if warp and len(warp["src_points"]) > 3 and len(warp["dst_points"]) > 3:
-            try:
-                h, _ = cv2.findHomography(
-                    np.array(warp["src_points"]), np.array(warp["dst_points"])
-                )
-
-                im_warp = cv2.warpPerspective(
-                    im, h, (im.shape[1], im.shape[0]), flags=cv2.INTER_CUBIC
-                )
-            except Exception as e:
-                logging.info("Failed to calculate homography: " + e)
-
-        if im_warp is None:
-            im_warp = im.copy()
-
-        return im_warp
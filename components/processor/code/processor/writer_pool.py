@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+import cv2
+import json
+import logging
+import os
+import queue
+
+from threading import Lock, Thread
+from time import time
+
+from crypt import encrypt_image
+
+
+def atomic_write(path, write):
+    """Write a file under a temporary name and rename it, so that readers
+    polling the folder never see a partially written file
+
+    Args:
+        path (str): Path of the file
+        write (Callable): Function writing the file to a given path
+    """
+    folder, name = os.path.split(path)
+    # hidden name without the final extension is ignored by the reader
+    tmp_path = os.path.join(folder, f".{name}.tmp")
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def write_bytes(path, data):
+    """Write bytes to a file
+
+    Args:
+        path (str): Path of the file
+        data (bytes-like): Content of the file
+    """
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def write_json(path, data):
+    """Write a JSON file
+
+    Args:
+        path (str): Path of the file
+        data (dict): Content of the file
+    """
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+
+
+class WriterPool:
+    def __init__(self, workers=4, queue_size=64, encrypt=False, debug=False):
+        """Pool of threads encoding ROI images and writing them with their
+        metadata. JPEG encoding releases the GIL, so images are encoded in
+        parallel with object detection and each other. The queue is bounded,
+        and adding to a full queue blocks until a worker is free. Each image is
+        written before its metadata, both through a temporary file.
+
+        Args:
+            workers (int, optional): Number of writer threads. Defaults to 4,
+                0 writes in the calling thread.
+            queue_size (int, optional): Number of ROIs waiting to be written.
+                Defaults to 64.
+            encrypt (bool, optional): Encrypt images. Defaults to False.
+            debug (bool, optional): Write unencrypted copies of encrypted images.
+                Defaults to False.
+        """
+        self.encrypt = encrypt
+        self.debug = debug
+        self.tasks = queue.Queue(maxsize=queue_size)
+        self.lock = Lock()
+        self.written = 0
+        self.failed = 0
+        self.blocked_seconds = 0.0
+        self.closed = False
+        self.threads = [Thread(target=self._run, daemon=True) for _ in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def put(self, image_path, im, metadata_path, metadata):
+        """Write a ROI image and its metadata, blocking while the queue is full.
+        Raises ValueError if the pool has been closed.
+
+        Args:
+            image_path (str): Path of the image
+            im (numpy.ndarray): ROI image, must not be modified afterwards
+            metadata_path (str): Path of the metadata
+            metadata (dict): Metadata of the ROI image
+        """
+        if self.closed:
+            raise ValueError("Writer pool is closed")
+        task = (image_path, im, metadata_path, metadata)
+        if not self.threads:
+            self._write(*task)
+            return
+        start = time()
+        self.tasks.put(task)
+        self.blocked_seconds += time() - start
+
+    def _run(self):
+        """Write queued ROIs until None is received"""
+        while True:
+            task = self.tasks.get()
+            try:
+                if task is None:
+                    break
+                self._write(*task)
+            finally:
+                self.tasks.task_done()
+
+    def _write(self, image_path, im, metadata_path, metadata):
+        """Encode and write a ROI image, and then its metadata
+
+        Args:
+            image_path (str): Path of the image
+            im (numpy.ndarray): ROI image
+            metadata_path (str): Path of the metadata
+            metadata (dict): Metadata of the ROI image
+        """
+        try:
+            if self.encrypt:
+                atomic_write(image_path, lambda path: encrypt_image(path, im))
+                if self.debug:
+                    cv2.imwrite(image_path + ".jpg", im)
+            else:
+                _, buffer = cv2.imencode(
+                    ".jpg", im, [int(cv2.IMWRITE_JPEG_QUALITY), 97]
+                )
+                atomic_write(image_path, lambda path: write_bytes(path, buffer))
+            atomic_write(metadata_path, lambda path: write_json(path, metadata))
+            with self.lock:
+                self.written += 1
+        except Exception as e:
+            logging.error(f"Could not write {image_path}: {str(e)}")
+            with self.lock:
+                self.failed += 1
+
+    def close(self):
+        """Write queued ROIs and stop the writer threads. Nothing may be put
+        afterwards."""
+        self.closed = True
+        for _ in self.threads:
+            self.tasks.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def statistics(self):
+        """Retrieve statistics of written ROIs
+
+        Returns:
+            dict: Number of queued, written and failed ROIs, and seconds the
+                  caller was blocked by a full queue
+        """
+        return {
+            "queued": self.tasks.qsize(),
+            "written": self.written,
+            "failed": self.failed,
+            "blocked_seconds": round(self.blocked_seconds, 2),
+        }
@@ -0,0 +1,206 @@
+"""
+    SORT with the Kalman filters of all tracks stacked into arrays, so that
+    predict and update run as one batched matrix operation per frame instead
+    of one filterpy KalmanFilter per track. Produces the same tracks and IDs
+    as sort.Sort, and shares its ID counter.
+
+    Update and predict take the number of frames elapsed since the previous
+    call, so the constant velocity model stays on time when frames are skipped.
+"""
+import numpy as np
+
+from sort.sort import KalmanBoxTracker, associate_detections_to_trackers
+
+# constant velocity model of state [x,y,s,r,x',y',s'], as in KalmanBoxTracker
+F = np.eye(7)
+F[0, 4] = F[1, 5] = F[2, 6] = 1
+H = np.eye(4, 7)
+R = np.eye(4)
+R[2:, 2:] *= 10.0
+P0 = np.eye(7)
+P0[4:, 4:] *= 1000.0  # give high uncertainty to the unobservable initial velocities
+P0 *= 10.0
+Q = np.eye(7)
+Q[-1, -1] *= 400.0
+Q[4:, 4:] *= 400.0
+
+
+def convert_bboxes_to_z(bboxes):
+    """
+    Takes bounding boxes in the form [[x1,y1,x2,y2],...] and returns z in the form
+      [[x,y,s,r],...] where x,y is the centre of the box and s is the scale/area and r is
+      the aspect ratio
+    """
+    w = bboxes[:, 2] - bboxes[:, 0]
+    h = bboxes[:, 3] - bboxes[:, 1]
+    x = bboxes[:, 0] + w / 2.0
+    y = bboxes[:, 1] + h / 2.0
+    return np.stack([x, y, w * h, w / h], axis=1)
+
+
+def convert_x_to_bboxes(x):
+    """
+    Takes states in the form [[x,y,s,r,...],...] and returns bounding boxes in the form
+      [[x1,y1,x2,y2],...] where x1,y1 is the top left and x2,y2 is the bottom right
+    """
+    w = np.sqrt(x[:, 2] * x[:, 3])
+    h = x[:, 2] / w
+    return np.stack(
+        [x[:, 0] - w / 2.0, x[:, 1] - h / 2.0, x[:, 0] + w / 2.0, x[:, 1] + h / 2.0],
+        axis=1,
+    )
+
+
+class BatchSort(object):
+    def __init__(self, max_age=1, min_hits=3, iou_threshold=0.3):
+        """
+        Sets key parameters for SORT
+        """
+        self.max_age = max_age
+        self.min_hits = min_hits
+        self.iou_threshold = iou_threshold
+        self.frame_count = 0
+        # one row per track, in the order tracks were created
+        self.x = np.zeros((0, 7))
+        self.P = np.zeros((0, 7, 7))
+        self.ids = np.zeros(0, dtype=int)
+        self.time_since_update = np.zeros(0, dtype=int)
+        self.hits = np.zeros(0, dtype=int)
+        self.hit_streak = np.zeros(0, dtype=int)
+        self.age = np.zeros(0, dtype=int)
+
+    def _keep(self, keep):
+        """
+        Keeps the tracks selected by a boolean mask.
+        """
+        self.x = self.x[keep]
+        self.P = self.P[keep]
+        self.ids = self.ids[keep]
+        self.time_since_update = self.time_since_update[keep]
+        self.hits = self.hits[keep]
+        self.hit_streak = self.hit_streak[keep]
+        self.age = self.age[keep]
+
+    def _advance(self, dt):
+        """
+        Advances the state vectors and covariances of all tracks by dt frames.
+        """
+        F_dt, Q_dt = F, Q
+        if dt != 1:
+            F_dt = F.copy()
+            F_dt[0, 4] = F_dt[1, 5] = F_dt[2, 6] = dt
+            # process noise accumulates over the elapsed frames
+            Q_dt = Q * dt
+        self.x[dt * self.x[:, 6] + self.x[:, 2] <= 0, 6] *= 0.0
+        self.x = self.x @ F_dt.T
+        self.P = F_dt @ self.P @ F_dt.T + Q_dt
+        self.age += 1
+
+    def _correct(self, t, bboxes):
+        """
+        Updates the state vectors of tracks t with observed bboxes.
+        """
+        self.time_since_update[t] = 0
+        self.hits[t] += 1
+        self.hit_streak[t] += 1
+
+        x = self.x[t]
+        P = self.P[t]
+        y = convert_bboxes_to_z(bboxes) - x @ H.T
+        PHT = P @ H.T
+        S = H @ PHT + R
+        K = PHT @ np.linalg.inv(S)
+        KT = K.transpose(0, 2, 1)
+        I_KH = np.eye(7) - K @ H
+        self.x[t] = x + (K @ y[:, :, None])[:, :, 0]
+        self.P[t] = I_KH @ P @ I_KH.transpose(0, 2, 1) + K @ R @ KT
+
+    def _create(self, bboxes):
+        """
+        Creates tracks for bboxes.
+        """
+        n = bboxes.shape[0]
+        x = np.zeros((n, 7))
+        x[:, :4] = convert_bboxes_to_z(bboxes)
+        self.x = np.concatenate([self.x, x])
+        self.P = np.concatenate([self.P, np.repeat(P0[None], n, axis=0)])
+        ids = KalmanBoxTracker.count + np.arange(n)
+        KalmanBoxTracker.count += n
+        self.ids = np.concatenate([self.ids, ids])
+        zeros = np.zeros(n, dtype=int)
+        self.time_since_update = np.concatenate([self.time_since_update, zeros])
+        self.hits = np.concatenate([self.hits, zeros])
+        self.hit_streak = np.concatenate([self.hit_streak, zeros])
+        self.age = np.concatenate([self.age, zeros])
+
+    def _confirmed(self):
+        """
+        Returns a mask of tracks updated on this frame and hit often enough to be reported.
+        """
+        return (self.time_since_update < 1) & (
+            (self.hit_streak >= self.min_hits) | (self.frame_count <= self.min_hits)
+        )
+
+    def update(self, dets=np.empty((0, 5)), dt=1):
+        """
+        Params:
+          dets - a numpy array of detections in the format [[x1,y1,x2,y2,score],[x1,y1,x2,y2,score],...]
+          dt - number of frames since the previous call, e.g. 2 when a frame was skipped
+        Requires: this method must be called once for each frame even with empty detections (use np.empty((0, 5)) for frames without detections).
+        Returns the a similar array, where the last column is the object ID.
+
+        NOTE: The number of objects returned may differ from the number of detections provided.
+        """
+        return self.assign(dets, dt)[0]
+
+    def assign(self, dets=np.empty((0, 5)), dt=1):
+        """
+        Same as update, but also returns the object ID of each detection: the ID of the returned
+        track the detection updated or started, or -1 if that track is not returned.
+        Returns the tracks and an array of IDs of the same length as dets.
+        """
+        self.frame_count += 1
+        # get predicted locations from existing trackers.
+        self._advance(dt)
+        self.hit_streak[self.time_since_update > 0] = 0
+        self.time_since_update += 1
+        trks = convert_x_to_bboxes(self.x)
+        valid = ~np.any(np.isnan(trks), axis=1)
+        self._keep(valid)
+        matched, unmatched_dets, _ = associate_detections_to_trackers(
+            dets, trks[valid], self.iou_threshold
+        )
+
+        # track of each detection
+        det_trks = np.full(len(dets), -1)
+
+        # update matched trackers with assigned detections
+        if len(matched):
+            self._correct(matched[:, 1], dets[matched[:, 0], :4])
+            det_trks[matched[:, 0]] = matched[:, 1]
+
+        # create and initialise new trackers for unmatched detections
+        if len(unmatched_dets):
+            unmatched_dets = unmatched_dets.astype(int)
+            det_trks[unmatched_dets] = len(self.ids) + np.arange(len(unmatched_dets))
+            self._create(dets[unmatched_dets, :4])
+
+        # +1 as MOT benchmark requires positive, newest tracks first as in Sort
+        confirmed = self._confirmed()
+        ret = np.c_[convert_x_to_bboxes(self.x), self.ids + 1][confirmed][::-1]
+        det_ids = np.where(confirmed[det_trks], self.ids[det_trks] + 1, -1)
+        # remove dead tracklet
+        self._keep(self.time_since_update <= self.max_age)
+        return ret, det_ids
+
+    def predict(self, dt=1):
+        """
+        Advances all trackers by dt frames without detections, for frames where detection is not run.
+        Call this instead of update. Skipped frames do not count as missed detections.
+        Returns the predicted boxes of tracks returned by the last update in the format [[x1,y1,x2,y2,ID],...]
+        """
+        self.frame_count += 1
+        self._advance(dt)
+        bboxes = convert_x_to_bboxes(self.x)
+        confirmed = self._confirmed() & ~np.any(np.isnan(bboxes), axis=1)
+        return np.c_[bboxes, self.ids + 1][confirmed]
@@ -171,6 +171,18 @@ class KalmanBoxTracker(object):
         self.history.append(convert_x_to_bbox(self.kf.x))
         return self.history[-1]
 
+    def coast(self):
+        """
+        Advances the state vector for a frame where detection was not run.
+        Unlike predict, this does not count as a missed detection.
+        Only used by Sort.predict, the reference BatchSort.predict is tested against.
+        """
+        if (self.kf.x[6] + self.kf.x[2]) <= 0:
+            self.kf.x[6] *= 0.0
+        self.kf.predict()
+        self.age += 1
+        return convert_x_to_bbox(self.kf.x)
+
     def get_state(self):
         """
         Returns the current bounding box estimate.
@@ -288,3 +300,26 @@ class Sort(object):
         if len(ret) > 0:
             return np.concatenate(ret)
         return np.empty((0, 5))
+
+    def predict(self):
+        """
+        Advances all trackers by one frame without detections, for frames where detection is not run.
+        Call this instead of update. Skipped frames do not count as missed detections.
+        Returns the predicted boxes of tracks returned by the last update in the format [[x1,y1,x2,y2,ID],...]
+
+        NOTE: The processor tracks with sort.batch_sort.BatchSort. This is kept only as the
+        reference implementation BatchSort.predict is tested against.
+        """
+        self.frame_count += 1
+        ret = []
+        for trk in self.trackers:
+            d = trk.coast()[0]
+            if np.any(np.isnan(d)):
+                continue
+            if (trk.time_since_update < 1) and (
+                trk.hit_streak >= self.min_hits or self.frame_count <= self.min_hits
+            ):
+                ret.append(np.concatenate((d, [trk.id + 1])).reshape(1, -1))
+        if len(ret) > 0:
+            return np.concatenate(ret)
+        return np.empty((0, 5))
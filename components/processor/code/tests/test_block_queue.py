@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import numpy as np
+
+from datetime import datetime, timedelta
+from threading import Event, Thread
+
+from processor.block_queue import BlockQueue
+from processor.disk_spill import DiskSpill
+
+
+class FakeFrame:
+    def __init__(self, frame_no, nbytes=100, frame_date=None, arrays=None):
+        self.frame_no = frame_no
+        self.frame_date = frame_date or datetime(2020, 1, 1) + timedelta(
+            seconds=frame_no / 10
+        )
+        if arrays is None:
+            arrays = {"im": np.full(nbytes, frame_no % 256, dtype=np.uint8)}
+        self.arrays = arrays
+        self.nbytes = sum(array.nbytes for array in arrays.values())
+
+    def to_arrays(self):
+        return self.arrays
+
+
+def load_frame(frame_date, frame_no, arrays):
+    return FakeFrame(frame_no, frame_date=frame_date, arrays=arrays)
+
+
+def make_block(start, length):
+    return [FakeFrame(frame_no) for frame_no in range(start, start + length)]
+
+
+def test_block_queue_order_and_seconds():
+    queue = BlockQueue(10000)
+    queue.put(make_block(0, 11))
+    queue.put(make_block(20, 6))
+
+    assert len(queue) == 2
+    assert queue.queued_seconds() == pytest.approx(1.5)
+    assert [f.frame_no for f in queue.get()] == list(range(0, 11))
+    assert queue.queued_seconds() == pytest.approx(0.5)
+    assert queue.get()[0].frame_no == 20
+    assert queue.get(timeout=0.01) is None
+
+
+def test_block_queue_wakes_up_consumer():
+    queue = BlockQueue(10000)
+    received = []
+    consumer = Thread(target=lambda: received.append(queue.get(timeout=5)))
+    consumer.start()
+    queue.put(make_block(0, 3))
+    consumer.join()
+
+    assert len(received[0]) == 3
+
+
+@pytest.mark.parametrize(
+    "policy,queued,dropped",
+    [
+        ("drop-newest", [[0, 1, 2, 3, 4, 5]], 6),
+        ("drop-oldest", [[10, 11, 12, 13, 14, 15]], 6),
+        ("downsample-block", [[0, 1, 2, 3, 4, 5], [10, 12, 14]], 3),
+    ],
+)
+def test_block_queue_drop_policies(policy, queued, dropped):
+    queue = BlockQueue(1000, policy)
+    queue.put(make_block(0, 6))
+    queue.put(make_block(10, 6))
+
+    assert queue.dropped_frames == dropped
+    assert queue.nbytes <= 1000
+    assert [[f.frame_no for f in queue.get()] for _ in range(len(queue))] == queued
+
+
+def test_disk_spill_round_trip(tmp_path):
+    spill = DiskSpill(str(tmp_path), 10**6, load_frame)
+    arrays = {
+        "im": np.random.randint(0, 256, (20, 30, 3), dtype=np.uint8),
+        "roi_01": np.random.rand(7, 5).astype(np.float32),
+    }
+    block = [FakeFrame(1, arrays=arrays), FakeFrame(2)]
+
+    assert spill.write(block, 0.1)
+    assert len(spill) == 1
+    restored = spill.read()
+
+    assert len(spill) == 0
+    assert not list(tmp_path.iterdir())
+    assert [f.frame_no for f in restored] == [1, 2]
+    assert restored[0].frame_date == block[0].frame_date
+    for name, array in arrays.items():
+        assert np.array_equal(restored[0].arrays[name], array)
+        assert restored[0].arrays[name].dtype == array.dtype
+    assert np.array_equal(restored[1].arrays["im"], block[1].arrays["im"])
+
+
+def test_block_queue_spills_in_order(tmp_path):
+    # a block of six 100 byte frames takes 1536 bytes on disk
+    spill = DiskSpill(str(tmp_path), 2 * 1536, load_frame)
+    queue = BlockQueue(1200, spill=spill)
+    for start in range(0, 50, 10):
+        queue.put(make_block(start, 6))
+
+    # two blocks in memory, two on disk, the last one does not fit anywhere
+    assert len(queue) == 4
+    assert queue.dropped_frames == 6
+    assert queue.queued_seconds() == pytest.approx(2.0)
+    assert [queue.get()[0].frame_no for _ in range(4)] == [0, 10, 20, 30]
+    assert queue.get(timeout=0.01) is None
+
+
+def test_block_queue_reads_spill_without_lock(tmp_path):
+    spill = DiskSpill(str(tmp_path), 10**6, load_frame)
+    queue = BlockQueue(0, spill=spill)
+    queue.put(make_block(0, 6))
+
+    reading, proceed = Event(), Event()
+    load = spill.load
+
+    def slow_load(filename):
+        reading.set()
+        proceed.wait(5)
+        return load(filename)
+
+    spill.load = slow_load
+    blocks = []
+    consumer = Thread(target=lambda: blocks.append(queue.get()))
+    consumer.start()
+    assert reading.wait(5)
+    # a block is added while the spilled block is being read
+    adder = Thread(target=queue.put, args=(make_block(10, 6),))
+    adder.start()
+    adder.join(1)
+    assert not adder.is_alive()
+    proceed.set()
+    consumer.join(5)
+
+    assert [f.frame_no for f in blocks[0]] == list(range(6))
+    assert [f.frame_no for f in queue.get(timeout=1)] == list(range(10, 16))
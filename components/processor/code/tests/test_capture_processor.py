@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+import cv2
+import json
+import os
+import numpy as np
+import pytest
+
+from datetime import datetime, timedelta
+from threading import Event, Thread, Timer
+
+import processor.capture_processor as capture_processor
+from object_detection.detections import detection_records, detections_to_dicts
+from processor.capture_processor import CaptureProcessor
+from processor.frame import Frame
+from processor.mask import Mask
+from processor.warp import Warp
+from processor.writer_pool import WriterPool
+
+
+@pytest.fixture
+def mask_filename(tmp_path):
+    im = np.zeros((200, 200, 3), dtype=np.uint8)
+    im[20:100, 20:100, :] = 255
+    im[120:180, 110:190, :] = 255
+    filename = str(tmp_path / "mask.png")
+    cv2.imwrite(filename, im)
+    return filename
+
+
+class SlowDetector:
+    """Detector stand-in finding a vehicle in the upper ROI of every frame.
+    Detection waits until the test lets it proceed."""
+
+    def __init__(self):
+        self.names = ["car"]
+        self.im_size = 64
+        self.detecting = Event()
+        self.proceed = Event()
+
+    def detect_batch_arrays(self, im0s, im_size):
+        self.detecting.set()
+        self.proceed.wait(5)
+        return [detection_records(np.array([[30, 30, 60, 60, 0.9, 0]])) for _ in im0s]
+
+    def detections_to_dicts(self, detections):
+        return detections_to_dicts(detections, self.names)
+
+
+class StubCapture:
+    """VideoCapture stand-in returning numbered frames, and calling a function
+    when the frames run out"""
+
+    def __init__(self, count, on_end):
+        self.count = count
+        self.on_end = on_end
+        self.frame = -1
+        self.frame_date = None
+
+    def get(self, prop):
+        return 1000.0
+
+    def isOpened(self):
+        return True
+
+    def read(self):
+        if self.frame + 1 >= self.count:
+            self.on_end()
+            return False, None
+        self.frame += 1
+        self.frame_date = datetime(2021, 1, 1) + timedelta(seconds=self.frame / 25)
+        return True, np.full((200, 200, 3), self.frame, dtype=np.uint8)
+
+
+class StubMotionDetector:
+    """Motion detector stand-in recording the checked frames, and detecting
+    motion in the first ROI of given frames"""
+
+    def __init__(self, triggers):
+        self.triggers = triggers
+        self.checked = []
+        self.roi_motion = np.array([True, False])
+
+    def detect(self, frame):
+        self.checked.append(frame.frame_no)
+        return frame.frame_no in self.triggers
+
+    def update(self, frame):
+        pass
+
+    def statistics(self):
+        return {}
+
+
+def create_processor(mask_filename, output_path):
+    processor = CaptureProcessor(
+        None, mask_filename, "/tmp/does_not_exist.json", 2, "test", str(output_path)
+    )
+    processor.mask = Mask(mask_filename)
+    processor.warp = Warp("/tmp/does_not_exist.json")
+    processor.yolo = SlowDetector()
+    processor.writer = WriterPool(workers=2, queue_size=4)
+    return processor
+
+
+def create_frames(processor, count):
+    im = np.full((200, 200, 3), 128, dtype=np.uint8)
+    start = datetime(2021, 1, 1)
+    return [
+        Frame(start + timedelta(seconds=i / 25), i, im, processor.mask, processor.warp)
+        for i in range(count)
+    ]
+
+
+def test_release_waits_for_detection(mask_filename, tmp_path, monkeypatch):
+    monkeypatch.setattr(capture_processor, "DEFAULT_SKIPRATE", 0)
+    monkeypatch.setattr(capture_processor, "YOLO_BATCH_SIZE", 4)
+    output_path = tmp_path / "output"
+    os.mkdir(output_path)
+    processor = create_processor(mask_filename, output_path)
+    detector, writer = processor.yolo, processor.writer
+
+    processor.keep_processing = True
+    processor.yolo_thread = Thread(target=processor._yolo_process, daemon=True)
+    processor.yolo_thread.start()
+    processor.image_cache.put(create_frames(processor, 10))
+    assert detector.detecting.wait(5)
+
+    # stop while the first chunk is being detected
+    processor.stop()
+    Timer(0.5, detector.proceed.set).start()
+    processor.release()
+
+    assert processor.yolo is None and processor.writer is None
+    # the chunk in flight is saved, later chunks are not started
+    assert writer.statistics()["written"] == 4 * 2
+    assert writer.statistics()["failed"] == 0
+    files = os.listdir(output_path)
+    assert len([f for f in files if f.endswith(".json")]) == 4 * 2
+    assert len([f for f in files if f.endswith(".jpg")]) == 4 * 2
+    assert not [f for f in files if f.endswith(".tmp")]
+
+
+@pytest.mark.parametrize(
+    "roi_output,motion,written,no_detection,no_motion",
+    [
+        ("all", None, 2, 0, 0),
+        ("detections", None, 1, 1, 0),
+        ("motion", "upper", 1, 1, 0),
+        ("motion", "lower", 0, 1, 1),
+        # frames without known motion are gated by detections only
+        ("motion", None, 1, 1, 0),
+    ],
+)
+def test_roi_output(
+    mask_filename,
+    tmp_path,
+    monkeypatch,
+    roi_output,
+    motion,
+    written,
+    no_detection,
+    no_motion,
+):
+    monkeypatch.setattr(capture_processor, "ROI_OUTPUT", roi_output)
+    output_path = tmp_path / "output"
+    os.mkdir(output_path)
+    processor = create_processor(mask_filename, output_path)
+    upper = int(np.argmin([roi["extent"][0] for roi in processor.mask.ROIs]))
+
+    frame = create_frames(processor, 1)[0]
+    if motion is not None:
+        moving = upper if motion == "upper" else 1 - upper
+        frame.roi_motion = np.arange(2) == moving
+    # a vehicle in the upper ROI only
+    detections = detection_records(np.array([[30, 30, 60, 60, 0.9, 0]]))
+    processor._process_frame(frame, detections, 0.0, 0, 64)
+    processor.writer.close()
+
+    assert processor.statistics()["roi_output"] == {
+        "written": written,
+        "no_detection": no_detection,
+        "no_motion": no_motion,
+    }
+    metadata = sorted(f for f in os.listdir(output_path) if f.endswith(".json"))
+    images = sorted(f for f in os.listdir(output_path) if f.endswith(".jpg"))
+    assert len(metadata) == len(images) == written
+    if roi_output != "all":
+        assert all(f"_roi_{upper:02d}_" in f for f in metadata + images)
+
+
+def test_motion_check_interval_and_pre_roll(mask_filename, tmp_path, monkeypatch):
+    monkeypatch.setattr(capture_processor, "MOTION_CHECK_INTERVAL", 3)
+    monkeypatch.setattr(capture_processor, "MOTION_PRE_ROLL", 4)
+    motion = StubMotionDetector(triggers={8})
+    monkeypatch.setattr(capture_processor, "get_motion_detector", lambda *_: motion)
+    processor = create_processor(mask_filename, tmp_path)
+    processor.cap = StubCapture(16, processor.stop)
+    # the block ends on the first frame after the trigger
+    processor.keep_sending_after_phash_diff = 0
+    # blocks stay in the queue
+    processor._yolo_process = lambda: None
+    processor.start()
+    processor.release()
+
+    # every 3rd frame is checked, and the first frame after a block
+    assert motion.checked == [2, 5, 8, 9, 12, 15]
+    # the block starts with the pre-roll frames preceding the trigger
+    block = processor.image_cache.get(timeout=0)
+    assert [frame.frame_no for frame in block] == [4, 5, 6, 7, 8]
+    assert [int(frame.im[0, 0, 0]) for frame in block] == [4, 5, 6, 7, 8]
+    assert all(frame.roi_motion.tolist() == [True, False] for frame in block)
+    assert processor.image_cache.get(timeout=0) is None
+
+
+def test_select_input_size(mask_filename, tmp_path, monkeypatch):
+    monkeypatch.setattr(capture_processor, "YOLO_INPUT_SIZES", [640, 512, 416])
+    monkeypatch.setattr(capture_processor, "YOLO_DOWNSIZE_LAG", 60)
+    monkeypatch.setattr(capture_processor, "YOLO_UPSIZE_LAG", 15)
+    processor = create_processor(mask_filename, tmp_path)
+    lags = [0, 70, 70, 70, 40, 61, 40, 14, 40, 10, 10, 40]
+    sizes = []
+    for lag in lags:
+        monkeypatch.setattr(processor.image_cache, "queued_seconds", lambda: lag)
+        sizes.append(processor._select_input_size())
+    processor.writer.close()
+
+    # one step per block, and no change between the two lags
+    assert sizes == [640, 512, 416, 416, 416, 416, 416, 512, 512, 640, 640, 640]
+    assert processor.input_size_index == 0
+
+
+def test_input_size_metadata(mask_filename, tmp_path):
+    processor = create_processor(mask_filename, tmp_path)
+    frames = create_frames(processor, 2)
+    detections = detection_records(np.array([[30, 30, 60, 60, 0.9, 0]]))
+    processor._process_frame(frames[0], detections, 0.0, 0, 512)
+    # frames without object detection have no input size
+    processor._process_frame(frames[1], None, 0.0, 0, None)
+    processor.writer.close()
+
+    input_sizes = {}
+    for filename in os.listdir(tmp_path):
+        if filename.endswith(".json"):
+            with open(tmp_path / filename) as f:
+                frame_no = int(filename.split("_f_")[1].split(".")[0])
+                input_sizes.setdefault(frame_no, set()).add(json.load(f)["input_size"])
+    assert input_sizes == {0: {512}, 1: {None}}
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+import cv2
+import numpy as np
+
+from object_detection.detections import detection_records
+from object_detection.worker_pool import DetectionPool
+
+
+def rectangle_geometry(im0_shape, im_size):
+    """Letterbox geometry padding to a multiple of 32, as the torch backend"""
+    height, width = im0_shape[:2]
+    r = min(im_size / height, im_size / width)
+    resized = int(round(height * r)), int(round(width * r))
+    dh, dw = (im_size - resized[0]) % 32 / 2, (im_size - resized[1]) % 32 / 2
+    top, left = int(round(dh - 0.1)), int(round(dw - 0.1))
+    shape = (
+        resized[0] + int(round(dh + 0.1)) + top,
+        resized[1] + int(round(dw + 0.1)) + left,
+    )
+    return shape, (top, left), resized
+
+
+class MeanDetector:
+    """Detector stand-in returning the mean pixel value of each image, so the
+    test can check images reach the workers intact and results come back in
+    submission order"""
+
+    def __init__(self):
+        self.names = ["car"]
+        self.im_size = 64
+        self.letterbox_geometry = rectangle_geometry
+
+    def letterbox_image(self, im0, im_size=None):
+        shape, (top, left), (height, width) = rectangle_geometry(
+            im0.shape, im_size or self.im_size
+        )
+        im = cv2.resize(im0, (width, height), interpolation=cv2.INTER_LINEAR)
+        return cv2.copyMakeBorder(
+            im,
+            top,
+            shape[0] - height - top,
+            left,
+            shape[1] - width - left,
+            cv2.BORDER_CONSTANT,
+            value=(114, 114, 114),
+        )
+
+    def detect_batch_arrays(self, im0s, im_size):
+        return [
+            detection_records(
+                np.array([[0, 0, im0.shape[1], im0.shape[0], im0.mean(), 0]])
+            )
+            for im0 in im0s
+        ]
+
+    def detect_letterboxed_batch_arrays(self, ims, im0_shapes):
+        return [
+            detection_records(np.array([[0, 0, shape[1], shape[0], im.mean(), 0]]))
+            for im, shape in zip(ims, im0_shapes)
+        ]
+
+
+def test_detection_pool_order():
+    pool = DetectionPool(MeanDetector, 2, 4 * 48 * 64 * 3)
+    try:
+        assert pool.names == ["car"] and pool.im_size == 64
+        batches = []
+        for b in range(10):
+            ims = [np.full((48, 64, 3), b * 10 + i, dtype=np.uint8) for i in range(4)]
+            batches.append(ims)
+            if b % 2:
+                pool.submit_letterboxed_batch(ims, [(480, 640, 3)] * len(ims))
+            else:
+                # non-contiguous views are copied as well
+                pool.submit_batch([im[:, ::-1] for im in ims])
+            # keep a few batches in flight
+            if pool.pending() > 3:
+                b_done = b - pool.pending() + 1
+                detections = pool.result()
+                assert [d["confidence"][0] for d in detections] == [
+                    b_done * 10 + i for i in range(4)
+                ]
+        while pool.pending():
+            b_done = len(batches) - pool.pending()
+            detections = pool.result()
+            assert [d["confidence"][0] for d in detections] == [
+                b_done * 10 + i for i in range(4)
+            ]
+            assert detections[0]["bbox"][0, 2] == (640 if b_done % 2 else 64)
+
+        dicts = pool.detections_to_dicts(detections[0])
+        assert dicts[0]["label"] == "car"
+    finally:
+        pool.close()
+
+
+def test_detection_pool_letterbox():
+    pool = DetectionPool(MeanDetector, 1, 64 * 64 * 3)
+    try:
+        im0 = np.random.default_rng(0).integers(0, 256, (40, 96, 3), dtype=np.uint8)
+        letterboxed = pool.letterbox_image(im0)
+        # same rectangle as letterboxed in the worker process
+        assert letterboxed.shape == (32, 64, 3)
+        assert np.array_equal(letterboxed, MeanDetector().letterbox_image(im0))
+        assert pool.letterbox_image(im0, 32).shape == (32, 32, 3)
+    finally:
+        pool.close()
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+import cv2
+import os
+import numpy as np
+import pytest
+
+from processor.frame import Frame
+from processor.mask import Mask
+from processor.motion import MOTION_DETECTORS, MotionDetector
+from processor.warp import Warp
+
+
+@pytest.fixture
+def mask():
+    im = np.zeros((200, 200, 3), dtype=np.uint8)
+    im[20:100, 20:100, :] = 255
+    im[120:180, 110:190, :] = 255
+
+    tmp_im_filename = "/tmp/test_motion.png"
+    cv2.imwrite(tmp_im_filename, im)
+    m = Mask(tmp_im_filename)
+    os.remove(tmp_im_filename)
+    return m
+
+
+@pytest.mark.parametrize(
+    "name,threshold", [("phash", 2), ("dct", 2), ("diff", 2), ("background", 2)]
+)
+def test_motion_detectors(mask, name, threshold):
+    warp = Warp("/tmp/does_not_exist.json")
+    detector = MOTION_DETECTORS[name](mask, threshold)
+
+    rng = np.random.default_rng(0)
+    background = cv2.GaussianBlur(
+        rng.integers(0, 256, (200, 200, 3), dtype=np.uint8), (15, 15), 5
+    )
+    background = cv2.normalize(background, None, 0, 255, cv2.NORM_MINMAX)
+
+    frame = Frame(None, 0, background, mask, warp)
+    detector.detect(frame)
+    detector.update(frame)
+    for frame_no in range(1, 4):
+        assert not detector.detect(Frame(None, frame_no, background, mask, warp))
+
+    im = background.copy()
+    # a "vehicle" appears in the lower ROI
+    moving = [roi["extent"][0] for roi in mask.ROIs].index(120)
+    cv2.rectangle(im, (120, 130), (170, 170), (255, 255, 255), -1)
+    cv2.rectangle(im, (130, 140), (160, 160), (0, 0, 0), -1)
+    frame = Frame(None, 4, im, mask, warp)
+    scores = detector.scores(frame)
+
+    assert scores[moving] > threshold
+    assert scores[1 - moving] <= threshold
+
+
+def test_adaptive_threshold(mask):
+    class NoisyMotionDetector(MotionDetector):
+        def scores(self, frame):
+            return frame
+
+    # backends must calculate scores, update is optional
+    with pytest.raises(TypeError):
+        MotionDetector(mask, 2)
+    detector = NoisyMotionDetector(mask, 2, adaptive=True, window=100)
+    rng = np.random.default_rng(0)
+    # first ROI is noisy, second is quiet
+    for _ in range(200):
+        detector.detect(np.array([rng.integers(3, 7), rng.integers(0, 2)]))
+
+    statistics = detector.statistics()
+    assert statistics["checked"] == 200
+    assert statistics["thresholds"][0] > 6
+    assert statistics["thresholds"][1] == 2
+    # noise does not trigger anymore, but a vehicle does
+    assert not detector.detect(np.array([6, 1]))
+    assert detector.detect(np.array([20, 1]))
+    assert detector.roi_motion.tolist() == [True, False]
+    assert detector.detect(np.array([0, 10]))
+    assert detector.roi_motion.tolist() == [False, True]
@@ -1,7 +1,21 @@
 # -*- coding: utf-8 -*-
 import cv2
+import logging
 import os
 import pytest
+import tracemalloc
+import numpy as np
+
+from time import time
+from object_detection.detections import VALID_VEHICLE_CLASSES
+from object_detection.onnx_backend import (
+    letterbox,
+    letterbox_geometry,
+    non_max_suppression,
+    scale_batch_coords,
+)
+from object_detection.preprocess import InputBuffers, apply_letterbox
+from object_detection.quantization import average_precision
 from object_detection.yolo import Yolov5
 
 
@@ -10,6 +24,11 @@ FIXTURE_DIR = os.path.join(
     "test_files",
 )
 
+VIDEO_PATH = os.getenv(
+    "VIDEO_PATH",
+    os.path.join(FIXTURE_DIR, "..", "..", "..", "videos"),
+)
+
 testdata_obj_detection = [
     [os.path.join(FIXTURE_DIR, "car1.jpg"), "car"],
 ]
@@ -24,3 +43,189 @@ def test_obj_detection(filename, expected):
 
     assert detections
     assert detections[0]["label"].lower() == expected.lower()
+
+
+@pytest.mark.parametrize("filename,expected", testdata_obj_detection)
+def test_obj_detection_batch(filename, expected):
+    im = cv2.imread(os.path.join(FIXTURE_DIR, filename))
+    im_flipped = cv2.flip(im, 1)
+
+    yolo = Yolov5()
+    batch_detections = yolo.detect_batch([im, im_flipped])
+
+    assert len(batch_detections) == 2
+    for im_single, detections in zip([im, im_flipped], batch_detections):
+        single_detections = yolo.detect(im_single)
+        assert [d["label"] for d in detections] == [
+            d["label"] for d in single_detections
+        ]
+        for d, d_single in zip(detections, single_detections):
+            assert d["bbox"] == pytest.approx(d_single["bbox"], abs=2)
+            assert d["confidence"] == pytest.approx(d_single["confidence"], abs=0.01)
+
+
+def iou(a, b):
+    w = min(a[2], b[2]) - max(a[0], b[0])
+    h = min(a[3], b[3]) - max(a[1], b[1])
+    inter = max(w, 0) * max(h, 0)
+    area_a = (a[2] - a[0]) * (a[3] - a[1])
+    area_b = (b[2] - b[0]) * (b[3] - b[1])
+    return inter / (area_a + area_b - inter)
+
+
+def matched(detection, detections, min_iou=0.7):
+    return any(
+        d["label"] == detection["label"]
+        and iou(d["bbox"], detection["bbox"]) >= min_iou
+        for d in detections
+    )
+
+
+def test_obj_detection_onnx_parity():
+    pytest.importorskip("onnxruntime")
+    video_filename = os.path.join(VIDEO_PATH, "demo.mp4")
+    if not os.path.exists(video_filename):
+        pytest.skip(f"{video_filename} not found")
+
+    cap = cv2.VideoCapture(video_filename)
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    ims = []
+    for frame_no in np.linspace(0, frame_count - 1, 10).astype(int):
+        cap.set(cv2.CAP_PROP_POS_FRAMES, frame_no)
+        ret, im = cap.read()
+        if ret:
+            ims.append(im)
+    cap.release()
+    assert ims
+
+    torch_yolo = Yolov5("torch")
+    onnx_yolo = Yolov5("onnx")
+    assert onnx_yolo.names == list(torch_yolo.names)
+
+    # the onnx model has a square input, so small differences are expected
+    # and only confident detections are compared
+    for torch_detections, onnx_detections in zip(
+        torch_yolo.detect_batch(ims), onnx_yolo.detect_batch(ims)
+    ):
+        for d in torch_detections:
+            if d["confidence"] >= 0.6:
+                assert matched(d, onnx_detections)
+        for d in onnx_detections:
+            if d["confidence"] >= 0.6:
+                assert matched(d, torch_detections)
+
+
+def test_nms_vehicle_classes():
+    names = ["person", "bicycle", "car", "motorcycle", "bus", "truck"]
+    classes = [names.index(label) for label in VALID_VEHICLE_CLASSES]
+
+    def row(xywh, label, score):
+        r = np.zeros(5 + len(names), dtype=np.float32)
+        r[:4] = xywh
+        r[4] = r[5 + names.index(label)] = score
+        return r
+
+    prediction = np.stack(
+        [
+            [
+                row((100, 100, 50, 50), "person", 0.9),
+                row((300, 150, 80, 40), "car", 0.9),
+                row((300, 150, 80, 40), "bicycle", 0.95),
+            ],
+            [
+                row((200, 100, 100, 60), "bus", 0.9),
+                row((400, 200, 40, 80), "person", 0.9),
+                row((0, 0, 1, 1), "car", 0.1),
+            ],
+        ]
+    )
+    # without class filtering the bicycle suppresses the car
+    pred = non_max_suppression(prediction, 0.4, 0.5)
+    assert pred[0][:, 5].tolist() == [1, 0]
+
+    # other classes are dropped before suppression
+    pred = non_max_suppression(prediction, 0.4, 0.5, classes)
+    assert [d[:, 5].tolist() for d in pred] == [[2], [4]]
+    assert pred[0][0, 4] == pytest.approx(0.81)
+
+    # frames of different shapes are rescaled separately
+    pred = scale_batch_coords((320, 640), pred, [(640, 1280, 3), (320, 640, 3)])
+    assert pred[0][:, :4].tolist() == [[520, 260, 680, 340]]
+    assert pred[1][:, :4].tolist() == [[150, 70, 250, 130]]
+
+    pred = non_max_suppression(prediction, 0.4, 0.5, classes)
+    pred = scale_batch_coords((320, 640), pred, [(640, 1280, 3)] * 2)
+    assert pred[0][:, :4].tolist() == [[520, 260, 680, 340]]
+    assert pred[1][:, :4].tolist() == [[300, 140, 500, 260]]
+
+
+def test_letterbox_geometry():
+    yolo = Yolov5()
+    im0 = np.random.default_rng(0).integers(0, 256, (720, 1280, 3), dtype=np.uint8)
+    geometry = yolo.letterbox_geometry(im0.shape, 640)
+
+    # detection pool letterboxes with the geometry of the backend
+    assert geometry[0] != (640, 640)
+    assert np.array_equal(apply_letterbox(im0, geometry), yolo.letterbox_image(im0))
+
+
+def test_average_precision():
+    references = [
+        [{"bbox": [0, 0, 10, 10], "confidence": 0.9, "label": "car"}],
+        [
+            {"bbox": [20, 20, 40, 40], "confidence": 0.8, "label": "car"},
+            {"bbox": [0, 0, 10, 10], "confidence": 0.8, "label": "bus"},
+        ],
+    ]
+
+    assert average_precision(references, references, "car") == (1.0, 1.0)
+    assert average_precision(references, references, "truck") == (None, None)
+
+    detections = [
+        [
+            {"bbox": [1, 0, 10, 10], "confidence": 0.7, "label": "car"},
+            {"bbox": [50, 50, 60, 60], "confidence": 0.9, "label": "car"},
+        ],
+        [],
+    ]
+    # a false positive ranked first, then one of two references found
+    ap, recall = average_precision(detections, references, "car")
+    assert recall == pytest.approx(0.5)
+    assert ap == pytest.approx(0.25)
+
+
+def test_preprocess_benchmark():
+    rng = np.random.default_rng(0)
+    im0s = [rng.integers(0, 256, (720, 1280, 3), dtype=np.uint8) for _ in range(4)]
+
+    def separate_passes():
+        im = np.stack([letterbox(im0, 640) for im0 in im0s])
+        im = np.ascontiguousarray(im[:, :, :, ::-1].transpose(0, 3, 1, 2))
+        im = im.astype(np.float32)
+        im /= 255.0
+        return im
+
+    buffers = InputBuffers(letterbox_geometry)
+
+    def fused_pass():
+        return buffers.from_frames(im0s, 640)
+
+    assert np.array_equal(fused_pass(), separate_passes())
+
+    results = {}
+    for name, preprocess in [("separate", separate_passes), ("fused", fused_pass)]:
+        preprocess()  # buffers are allocated on first use
+        tracemalloc.start()
+        start = time()
+        for _ in range(5):
+            preprocess()
+        elapsed = (time() - start) / 5
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[name] = (elapsed, peak)
+        logging.info(
+            f"{name}: {elapsed * 1000:.1f} ms, peak allocation {peak / 1e6:.1f} MB"
+        )
+
+    # buffers are reused, only small temporaries are allocated
+    assert results["fused"][1] < results["separate"][1] / 10
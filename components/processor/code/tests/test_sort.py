@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from sort.batch_sort import BatchSort
+from sort.sort import KalmanBoxTracker, Sort, iou_batch
+
+
+def moving_box(frame_no, velocity=(8.0, 2.0)):
+    x = 100 + velocity[0] * frame_no
+    y = 50 + velocity[1] * frame_no
+    return np.array([[x, y, x + 80, y + 40, 0.9]])
+
+
+@pytest.mark.parametrize("tracker_class", [Sort, BatchSort])
+def test_sort_predict_between_detections(tracker_class):
+    tracker = tracker_class(max_age=5, min_hits=3, iou_threshold=0.3)
+    for frame_no in range(10):
+        tracks = tracker.update(moving_box(frame_no))
+    assert tracks.shape == (1, 5)
+    track_id = tracks[0, 4]
+
+    # detect every third frame, predict the others
+    for frame_no in range(10, 40):
+        if frame_no % 3 == 0:
+            tracks = tracker.update(moving_box(frame_no))
+        else:
+            tracks = tracker.predict()
+        assert tracks.shape == (1, 5)
+        assert tracks[0, 4] == track_id
+        assert np.allclose(tracks[0, :4], moving_box(frame_no)[0, :4], atol=4)
+
+
+@pytest.mark.parametrize("tracker_class", [Sort, BatchSort])
+def test_sort_predict_without_tracks(tracker_class):
+    tracker = tracker_class()
+    assert tracker.predict().shape == (0, 5)
+
+    # tracks lost at the last update are not predicted
+    tracker.update(moving_box(0))
+    tracker.update()
+    assert tracker.predict().shape == (0, 5)
+
+
+def recorded_sequence(frames=300, seed=1):
+    """Detections of vehicles entering and leaving the view with noise,
+    missed detections and false positives"""
+    rng = np.random.RandomState(seed)
+    vehicles = []
+    sequence = []
+    for frame_no in range(frames):
+        if rng.rand() < 0.1:
+            vehicles.append(
+                [rng.uniform(0, 1000), rng.uniform(0, 600)]
+                + [rng.uniform(40, 200), rng.uniform(30, 120)]
+                + [rng.uniform(-15, 15), rng.uniform(-5, 5)]
+            )
+        dets = []
+        for v in vehicles:
+            v[0] += v[4]
+            v[1] += v[5]
+            if rng.rand() < 0.85:
+                x, y = v[0] + rng.normal(0, 2), v[1] + rng.normal(0, 2)
+                dets.append([x, y, x + v[2], y + v[3], rng.uniform(0.4, 1)])
+        if rng.rand() < 0.2:
+            x, y = rng.uniform(0, 1000, 2)
+            dets.append([x, y, x + 50, y + 50, 0.5])
+        vehicles = [v for v in vehicles if -200 < v[0] < 1200]
+        sequence.append(np.array(dets).reshape(-1, 5))
+    return sequence
+
+
+def test_batch_sort_matches_sort():
+    sequence = recorded_sequence()
+    results = []
+    for tracker_class in (Sort, BatchSort):
+        KalmanBoxTracker.count = 0
+        tracker = tracker_class(max_age=5, min_hits=3, iou_threshold=0.3)
+        tracks = []
+        for frame_no, dets in enumerate(sequence):
+            if frame_no % 4 == 3:
+                tracks.append(tracker.predict())
+            else:
+                tracks.append(tracker.update(dets))
+        results.append(tracks)
+
+    assert sum(len(t) for t in results[0]) > 500
+    for sort_tracks, batch_tracks in zip(*results):
+        assert sort_tracks.shape == batch_tracks.shape
+        assert np.array_equal(sort_tracks[:, 4], batch_tracks[:, 4])
+        assert np.allclose(sort_tracks[:, :4], batch_tracks[:, :4])
+
+
+def test_batch_sort_skipped_frames():
+    rng = np.random.RandomState(0)
+    tracker = BatchSort(max_age=5, min_hits=3, iou_threshold=0.3)
+    track_ids = set()
+    last_frame_no = 0
+    for frame_no in range(300):
+        # track a fast vehicle with most frames skipped
+        if frame_no > 5 and rng.rand() < 0.6:
+            continue
+        box = moving_box(frame_no, velocity=(20.0, 0.0))
+        tracks = tracker.update(box, max(1, frame_no - last_frame_no))
+        last_frame_no = frame_no
+        track_ids.update(tracks[:, 4].tolist())
+        if frame_no > 5:
+            assert tracks.shape == (1, 5)
+            assert np.allclose(tracks[0, :4], box[0, :4], atol=1)
+    assert len(track_ids) == 1
+
+
+def test_batch_sort_assignment():
+    tracker = BatchSort(max_age=5, min_hits=3, iou_threshold=0.3)
+    for frame_no, dets in enumerate(recorded_sequence(100)):
+        tracks, det_ids = tracker.assign(dets)
+        assert det_ids.shape == (len(dets),)
+        # each returned track has exactly one detection, the others none
+        assigned = det_ids[det_ids >= 0]
+        assert sorted(assigned.tolist()) == sorted(tracks[:, 4].tolist())
+        for det_id, det in zip(det_ids, dets):
+            if det_id >= 0:
+                track = tracks[tracks[:, 4] == det_id][0]
+                assert iou_batch(det[None, :4], track[None, :4])[0, 0] > 0.3
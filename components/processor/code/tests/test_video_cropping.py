@@ -1,8 +1,13 @@
 # -*- coding: utf-8 -*-
 import cv2
+import json
+import logging
 import os
 import numpy as np
 
+from time import time
+
+from processor.frame import Frame
 from processor.mask import Mask
 from processor.warp import Warp
 
@@ -20,6 +25,129 @@ def test_mask_roi_count():
     assert m.ROI_count() == 2
 
 
+def test_mask_apply_rois():
+    im = np.zeros((100, 100, 3), dtype=np.uint8)
+    im[10:40, 10:40, :] = 128
+    cv2.circle(im, (70, 70), 15, (128, 128, 128), -1)
+
+    tmp_im_filename = "/tmp/test.png"
+    cv2.imwrite(tmp_im_filename, im)
+    m = Mask(tmp_im_filename)
+    os.remove(tmp_im_filename)
+
+    frame = np.random.randint(0, 256, (100, 100, 3), dtype=np.uint8)
+    for roi, roi_im in zip(m.ROIs, m.apply_ROIs(frame)):
+        extent = roi["extent"]
+        mask = np.dstack((roi["mask"], roi["mask"], roi["mask"]))
+        expected = cv2.bitwise_and(frame, mask)[
+            extent[0] : extent[1], extent[2] : extent[3]
+        ]
+        assert np.array_equal(roi_im, expected)
+
+    assert sorted(roi["is_rect"] for roi in m.ROIs) == [False, True]
+
+
+def test_mask_roi_iods():
+    im = np.zeros((100, 100, 3), dtype=np.uint8)
+    cv2.circle(im, (40, 40), 25, (128, 128, 128), -1)
+
+    tmp_im_filename = "/tmp/test.png"
+    cv2.imwrite(tmp_im_filename, im)
+    m = Mask(tmp_im_filename)
+    os.remove(tmp_im_filename)
+
+    rng = np.random.default_rng(0)
+    detections = [{"bbox": bbox} for bbox in rng.uniform(-30, 130, (200, 4)).tolist()]
+    roi_detections, roi_iods = m.get_roi_detections(detections, 0)
+
+    # reference: rasterize each detection and count overlapping mask pixels
+    expected_detections, expected_iods = [], []
+    for d in detections:
+        det_mask = np.zeros_like(m.ROIs[0]["mask"])
+        p1 = (int(d["bbox"][0] + 0.5), int(d["bbox"][1] + 0.5))
+        p2 = (int(d["bbox"][2] + 0.5), int(d["bbox"][3] + 0.5))
+        cv2.rectangle(det_mask, p1, p2, 255, -1)
+        area_det = np.count_nonzero(det_mask)
+        area_intersection = np.count_nonzero(
+            cv2.bitwise_and(det_mask, m.ROIs[0]["mask"])
+        )
+        if area_det > 0 and area_intersection > 0:
+            expected_detections.append(d)
+            expected_iods.append(area_intersection / area_det)
+
+    assert roi_detections == expected_detections
+    assert roi_iods == expected_iods
+
+
+def test_mask_detection_slice():
+    im = np.zeros((100, 120, 3), dtype=np.uint8)
+    im[30:50, 30:50, :] = 128
+    im[60:80, 70:80, :] = 128
+
+    tmp_im_filename = "/tmp/test.png"
+    cv2.imwrite(tmp_im_filename, im)
+    m = Mask(tmp_im_filename)
+    os.remove(tmp_im_filename)
+
+    assert m.get_detection_slice() == (slice(30, 80), slice(30, 80))
+    assert m.get_detection_slice(10) == (slice(20, 90), slice(20, 90))
+    assert m.get_detection_slice(40) == (slice(0, 100), slice(0, 120))
+
+
+def test_frame_roi_cache():
+    im = np.zeros((100, 100, 3), dtype=np.uint8)
+    im[30:50, 30:50, :] = 128
+    im[60:80, 70:80, :] = 128
+
+    tmp_im_filename = "/tmp/test.png"
+    cv2.imwrite(tmp_im_filename, im)
+    m = Mask(tmp_im_filename)
+    os.remove(tmp_im_filename)
+    w = Warp("/tmp/does_not_exist.json")
+
+    frame_im = np.random.randint(0, 256, (100, 100, 3), dtype=np.uint8)
+    frame = Frame(None, 0, frame_im, m, w)
+    roi_images = frame.roi_images()
+
+    assert len(roi_images) == 2
+    for i, roi_im in enumerate(m.apply_ROIs(frame_im)):
+        assert np.array_equal(roi_images[i], roi_im)
+        assert frame.roi(i) is roi_images[i]
+
+
+def test_frame_compact():
+    im = np.zeros((100, 100, 3), dtype=np.uint8)
+    im[30:50, 30:50, :] = 128
+
+    tmp_im_filename = "/tmp/test.png"
+    cv2.imwrite(tmp_im_filename, im)
+    m = Mask(tmp_im_filename)
+    os.remove(tmp_im_filename)
+    w = Warp("/tmp/does_not_exist.json")
+
+    frame_im = np.random.randint(0, 256, (100, 100, 3), dtype=np.uint8)
+    frame = Frame(None, 0, frame_im, m, w)
+    frame.compact(lambda im: cv2.resize(im, (64, 64)))
+
+    assert frame.im is None
+    assert frame.im_shape == (100, 100, 3)
+    assert frame.detector_im.shape == (64, 64, 3)
+    assert np.array_equal(frame.roi(0), next(m.apply_ROIs(frame_im)))
+    assert frame.nbytes < frame_im.nbytes
+
+    frame.roi_motion = np.array([True])
+    restored = Frame.from_arrays(None, 0, frame.to_arrays(), m, w)
+    assert restored.im is None
+    assert restored.im_shape == frame.im_shape
+    assert np.array_equal(restored.detector_im, frame.detector_im)
+    assert np.array_equal(restored.roi(0), frame.roi(0))
+    assert restored.roi_motion.tolist() == [True]
+    assert (
+        Frame.from_arrays(None, 0, {"im_shape": np.array((1, 1))}, m, w).roi_motion
+        is None
+    )
+
+
 def test_warp():
     im = np.zeros((100, 100, 3), dtype=np.uint8)
     im[10:30, 10:30, :] = 128
@@ -60,3 +188,57 @@ def test_warp():
 
     assert np.mean(im_mean) > ref_mean - epsilon
     assert np.mean(im_mean) < ref_mean + epsilon
+
+
+def test_warp_remap_benchmark():
+    warp_filename = "/tmp/warp.json"
+    with open(warp_filename, "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "warps": [
+                    {
+                        "roi_id": 0,
+                        "src_points": [[100, 100], [600, 120], [620, 500], [90, 480]],
+                        "dst_points": [[80, 100], [620, 100], [620, 520], [80, 520]],
+                    }
+                ]
+            },
+            f,
+        )
+
+    w = Warp(warp_filename)
+    os.remove(warp_filename)
+
+    rng = np.random.default_rng(0)
+    im = cv2.GaussianBlur(
+        rng.integers(0, 256, (660, 700, 3), dtype=np.uint8), (9, 9), 3
+    )
+    h = w.homographies[0]
+    im_reference = cv2.warpPerspective(
+        im, h, (im.shape[1], im.shape[0]), flags=cv2.INTER_CUBIC
+    )
+    im_warped = w.apply(im, roi_id=0)
+
+    # both use 1/32 pixel fixed-point coordinates, only rounding may differ
+    diff = np.abs(im_reference.astype(int) - im_warped)
+    assert diff.max() <= 4
+    assert np.mean(diff > 1) < 0.001
+
+    rounds = 20
+    started = time()
+    for _ in range(rounds):
+        h, _ = cv2.findHomography(
+            np.array([[100, 100], [600, 120], [620, 500], [90, 480]]),
+            np.array([[80, 100], [620, 100], [620, 520], [80, 520]]),
+        )
+        cv2.warpPerspective(im, h, (im.shape[1], im.shape[0]), flags=cv2.INTER_CUBIC)
+    time_reference = (time() - started) / rounds
+    started = time()
+    for _ in range(rounds):
+        w.apply(im, roi_id=0)
+    time_remap = (time() - started) / rounds
+    logging.info(
+        "Warp benchmark: warpPerspective {}ms, remap {}ms".format(
+            round(1000 * time_reference, 2), round(1000 * time_remap, 2)
+        )
+    )
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+import cv2
+import json
+import os
+import numpy as np
+import pytest
+
+from processor.writer_pool import WriterPool
+
+
+def test_writer_pool(tmp_path):
+    writer = WriterPool(workers=3, queue_size=2)
+    ims = []
+    for i in range(20):
+        im = np.full((60, 80, 3), i * 10, dtype=np.uint8)
+        ims.append(im)
+        writer.put(
+            str(tmp_path / f"roi_{i:02d}.jpg"),
+            im,
+            str(tmp_path / f"roi_{i:02d}.json"),
+            {"track_ids": [i]},
+        )
+    # metadata which can not be serialized leaves no partial file
+    writer.put(
+        str(tmp_path / "roi_bad.jpg"),
+        ims[0],
+        str(tmp_path / "roi_bad.json"),
+        {"track_ids": object()},
+    )
+    writer.close()
+    with pytest.raises(ValueError):
+        writer.put(str(tmp_path / "late.jpg"), ims[0], str(tmp_path / "late.json"), {})
+
+    assert writer.statistics()["written"] == 20
+    assert writer.statistics()["failed"] == 1
+    assert not [f for f in os.listdir(tmp_path) if f.endswith(".tmp")]
+    assert not os.path.exists(tmp_path / "roi_bad.json")
+    for i, im in enumerate(ims):
+        with open(tmp_path / f"roi_{i:02d}.json") as f:
+            assert json.load(f) == {"track_ids": [i]}
+        written = cv2.imread(str(tmp_path / f"roi_{i:02d}.jpg"))
+        assert np.abs(written.astype(int) - im).max() <= 2